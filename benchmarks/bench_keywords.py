@@ -0,0 +1,86 @@
+"""Cost of highlighting keywords in a large synthetic log.
+
+Compares searching each keyword pattern in turn after each keyword, which
+the wrapper used before, with `KeywordMatcher`, on lines of a synthetic
+log with the default keyword patterns, and `KeywordMatcher.highlight_lines`,
+which scans chunks of `--chunk-lines` lines at once as `_output_hook` does
+with stream messages. No kernel is started.
+With `--unanchored`, patterns without leading literals, which are searched
+unless their required literals let the prefilter reject the line, are
+added to the default ones.
+
+    python -m benchmarks.bench_keywords [--lines N] [--chunk-lines N] [--repeat N]
+                                        [--unanchored] [--short]
+"""
+
+import argparse
+import re
+import time
+
+from lc_wrapper.kernel import IPYTHON_DEFAULT_PATTERN
+from lc_wrapper.keywords import KeywordMatcher
+
+from tests.helpers import highlight_one_by_one, synthetic_log
+
+
+UNANCHORED_PATTERNS = [r'[0-9]+ (errors|failures)', r'\w+Error\b', r'[A-Za-z]+Exception',
+                       r'\s+Traceback']
+
+
+def default_patterns(unanchored=False):
+    patterns = IPYTHON_DEFAULT_PATTERN.splitlines()
+    if unanchored:
+        patterns += UNANCHORED_PATTERNS
+    return [re.compile(p) for p in patterns]
+
+
+def run(highlight, log):
+    start = time.perf_counter()
+    matched = 0
+    for line in log:
+        if highlight(line) is not None:
+            matched += 1
+    return time.perf_counter() - start, matched
+
+
+def run_chunks(matcher, chunks):
+    start = time.perf_counter()
+    matched = 0
+    for chunk in chunks:
+        matched += len(matcher.highlight_lines(chunk, chunk.splitlines()))
+    return time.perf_counter() - start, matched
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=1000000)
+    parser.add_argument('--chunk-lines', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--unanchored', action='store_true')
+    parser.add_argument('--short', action='store_true',
+                        help='lines of a number and at most one word, as printed by a progress loop')
+    args = parser.parse_args(argv)
+
+    log = synthetic_log(args.lines, line_words=(0, 1) if args.short else (8, 16))
+    size = sum(len(line) + 1 for line in log)
+    patterns = default_patterns(args.unanchored)
+    matcher = KeywordMatcher(patterns)
+    chunks = ['\n'.join(log[i:i + args.chunk_lines]) + '\n'
+              for i in range(0, len(log), args.chunk_lines)]
+    engines = [
+        ('one by one', lambda: run(lambda line: highlight_one_by_one(patterns, line), log)),
+        ('KeywordMatcher', lambda: run(matcher.highlight, log)),
+        ('highlight_lines', lambda: run_chunks(matcher, chunks)),
+    ]
+    print('# {} lines, {:.1f} MB, {} patterns'.format(len(log), size / 1e6, len(patterns)))
+    for name, engine in engines:
+        results = [engine() for _ in range(args.repeat)]
+        elapsed = min(r[0] for r in results)
+        print('{:<16} {:8.3f}s {:10.0f} lines/s {:8.1f} MB/s ({} lines matched, best of {})'.format(
+            name, elapsed, len(log) / elapsed, size / elapsed / 1e6, results[0][1], args.repeat))
+    print('prefilter rejected {:.1%} of the lines, {} patterns without literal'.format(
+        matcher.lines_rejected / matcher.lines_checked, len(matcher.unfiltered_patterns)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Throughput of masking stream output split in chunks.
+
+Compares masking each chunk on its own, as the wrapper did before and
+which leaks the secrets split across chunks, with `StreamMasker`, on a
+synthetic log holding secrets and cut into chunks of `--chunk-size`
+characters regardless of line boundaries. With `--secrets N`, N random
+literal secrets are also masked, as one alternation of the escaped
+secrets chunk by chunk, and with a `LiteralMatcher` in `StreamMasker`, as
+with `lc_wrapper_masking_file`. No kernel is started.
+
+    python -m benchmarks.bench_masking [--lines N] [--chunk-size N] [--repeat N]
+                                       [--secrets N]
+"""
+
+import argparse
+import random
+import re
+import string
+import time
+
+from lc_wrapper.masking import LiteralMatcher, StreamMasker
+
+from tests.helpers import SECRETS, secret_log
+
+
+PATTERNS = [
+    r'AKIA[0-9A-Z]{16}',
+    r'((070|080|090)-\d{4}-\d{4}|0\d-\d{4}-\d{4}|0\d{1,2}-\d{3,4}-\d{4})|'
+    r'[0-9a-zA-Z_]+@[0-9a-zA-Z.]+?com',
+]
+
+
+def random_secrets(count, seed=0):
+    rand = random.Random(seed)
+    chars = string.ascii_letters + string.digits
+    return [''.join(rand.choice(chars) for _ in range(rand.randint(16, 40)))
+            for _ in range(count)]
+
+
+def mask_each_chunk(pattern, chunks):
+    def asterisks_repl(match):
+        return len(match[0]) * '*'
+    return ''.join(re.sub(pattern, asterisks_repl, chunk) for chunk in chunks)
+
+
+def mask_stream(pattern, chunks, literals=None):
+    masker = StreamMasker(pattern, literals=literals)
+    return ''.join(masker.feed(chunk) for chunk in chunks) + masker.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=200000)
+    parser.add_argument('--chunk-size', type=int, default=4096)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--secrets', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    text = secret_log(args.lines)
+    chunks = split_chunks(text, args.chunk_size)
+    print('# {} lines, {:.1f} MB, {} chunks of {} characters'.format(
+        args.lines, len(text) / 1e6, len(chunks), args.chunk_size))
+    for p in PATTERNS:
+        pattern = re.compile(p)
+        secrets = [s for s in SECRETS if pattern.fullmatch(s)]
+        print('pattern: {}'.format(p))
+        report('each chunk', lambda: mask_each_chunk(pattern, chunks), text, secrets, args.repeat)
+        report('StreamMasker', lambda: mask_stream(pattern, chunks), text, secrets, args.repeat)
+
+    if args.secrets > 0:
+        secrets = random_secrets(args.secrets)
+        text = secret_log(args.lines, secrets)
+        chunks = split_chunks(text, args.chunk_size)
+        print('{} literal secrets'.format(len(secrets)))
+        start = time.perf_counter()
+        pattern = re.compile('|'.join(re.escape(s) for s in sorted(secrets, key=len, reverse=True)))
+        print('  {:<14} {:8.3f}s to compile'.format('alternation', time.perf_counter() - start))
+        start = time.perf_counter()
+        literals = LiteralMatcher(secrets)
+        print('  {:<14} {:8.3f}s to compile'.format('LiteralMatcher', time.perf_counter() - start))
+        report('alternation', lambda: mask_each_chunk(pattern, chunks), text, secrets, 1)
+        report('LiteralMatcher', lambda: mask_stream(None, chunks, literals), text, secrets,
+               args.repeat)
+
+
+def split_chunks(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def report(name, mask, text, secrets, repeat):
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        masked = mask()
+        elapsed.append(time.perf_counter() - start)
+    leaked = sum(masked.count(s) for s in secrets)
+    print('  {:<14} {:8.3f}s {:8.1f} MB/s ({} secrets left, best of {})'.format(
+        name, min(elapsed), len(text) / min(elapsed) / 1e6, leaked, repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Cost of rewriting the msg_id in the content of rich outputs.
+
+Compares the recursive traversal of the whole content, which the wrapper
+used before, with the rewrite of the fields in
+`BufferedKernelBase.msg_id_content_fields`, on large `display_data`
+payloads and a widget state update. No kernel is started.
+
+    python -m benchmarks.bench_msg_id [--repeat N]
+"""
+
+import argparse
+import base64
+import logging
+import os
+
+from jupyter_client.session import Session
+
+from lc_wrapper.kernel import BufferedKernelBase
+
+from .utils import format_samples, measure
+
+
+WRAPPED_MSG_ID = 'wrapped-msg-id'
+MSG_ID = 'msg-id'
+
+
+class Rewriter(object):
+    msg_id_content_fields = BufferedKernelBase.msg_id_content_fields
+    log = logging.getLogger(__name__)
+
+    _replace_msg_id = BufferedKernelBase._replace_msg_id
+
+    def _replace_msg_id_recursive(self, msg_id, wrapped_msg_id, content):
+        for k, v in content.items():
+            if isinstance(v, dict):
+                self._replace_msg_id_recursive(msg_id, wrapped_msg_id, v)
+            elif v == wrapped_msg_id:
+                content[k] = msg_id
+
+
+def payloads():
+    image = base64.b64encode(os.urandom(2 * 1024 * 1024)).decode('ascii')
+    yield 'display_data image/png 2MiB', 'display_data', {
+        'data': {'image/png': image, 'text/plain': '<Figure>'},
+        'metadata': {'image/png': {'width': 640, 'height': 480}},
+        'transient': {}}
+    table = {'row%d' % r: {'col%d' % c: r * c for c in range(20)}
+             for r in range(5000)}
+    yield 'display_data json 5000x20', 'display_data', {
+        'data': {'application/json': table, 'text/plain': '<Table>'},
+        'metadata': {}, 'transient': {}}
+    yield 'comm_msg widget state', 'comm_msg', {
+        'comm_id': 'abc',
+        'data': {'method': 'update', 'state': {'msg_id': WRAPPED_MSG_ID},
+                 'buffer_paths': []}}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args(argv)
+
+    session = Session()
+    rewriter = Rewriter()
+    for name, msg_type, content in payloads():
+        packed = session.pack(content)
+        print('# {} ({} bytes packed)'.format(name, len(packed)))
+
+        def recursive():
+            unpacked = session.unpack(packed)
+            rewriter._replace_msg_id_recursive(MSG_ID, WRAPPED_MSG_ID, unpacked)
+
+        def targeted():
+            unpacked = session.unpack(packed)
+            rewriter._replace_msg_id(MSG_ID, WRAPPED_MSG_ID, msg_type, unpacked)
+
+        def rewrite_only(rewrite):
+            unpacked = session.unpack(packed)
+            return lambda: rewrite(unpacked)
+
+        print(format_samples('unpack + recursive', measure(recursive, args.repeat)))
+        print(format_samples('unpack + targeted', measure(targeted, args.repeat)))
+        print(format_samples('recursive only', measure(rewrite_only(
+            lambda c: rewriter._replace_msg_id_recursive(MSG_ID, WRAPPED_MSG_ID, c)),
+            args.repeat)))
+        print(format_samples('targeted only', measure(rewrite_only(
+            lambda c: rewriter._replace_msg_id(MSG_ID, WRAPPED_MSG_ID, msg_type, c)),
+            args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
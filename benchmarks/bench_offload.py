@@ -0,0 +1,107 @@
+"""Throughput of masking and keyword scanning of large stream chunks.
+
+Compares processing chunks of `--chunk-size` characters of a synthetic log
+with secrets in the kernel, as `_output_hook` does by default, with
+`OutputProcessPool` and 1, 2, 4, ... worker processes up to `--processes`,
+as with `lc_wrapper_output_processes`. Each chunk is masked with
+`StreamMasker` and scanned with `KeywordMatcher.highlight_lines`, with the
+default keyword patterns and those without leading literals. The speedup
+depends on the number of cores of the host, which is printed. No kernel
+is started.
+
+    python -m benchmarks.bench_offload [--lines N] [--chunk-size N] [--repeat N]
+                                       [--processes N]
+"""
+
+import argparse
+import os
+import re
+import time
+
+from lc_wrapper.keywords import KeywordMatcher
+from lc_wrapper.masking import StreamMasker
+from lc_wrapper.offload import OutputProcessPool
+
+from .bench_keywords import default_patterns
+from tests.helpers import SECRETS, secret_log
+
+from .bench_masking import PATTERNS, split_chunks
+
+
+def process_inline(pattern, matcher, chunks):
+    masker = StreamMasker(pattern)
+    matched = []
+    for chunk in chunks:
+        masked = masker.feed(chunk)
+        matched.extend(matcher.highlight_lines(masked, masked.splitlines()))
+    return matched
+
+
+def process_in_pool(pool, pattern, matcher, chunks):
+    masker = StreamMasker(pattern)
+    matched = []
+    for chunk in chunks:
+        # as BufferedKernelBase._feed_stream_masker
+        first = chunk.find(u'\n') + 1
+        last = chunk.rfind(u'\n') + 1
+        pieces = pool.split(chunk[first:last])
+        if pieces is None:
+            masked = masker.feed(chunk)
+        else:
+            masked = masker.feed(chunk[:first]) + pool.mask(pieces) + masker.feed(chunk[last:])
+        pieces = pool.split(masked)
+        if pieces is None:
+            matched.extend(matcher.highlight_lines(masked, masked.splitlines()))
+        else:
+            matched.extend(pool.highlight_lines(pieces))
+    return matched
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=200000)
+    parser.add_argument('--chunk-size', type=int, default=1 << 20)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+
+    text = secret_log(args.lines, SECRETS, secret_ratio=0.05)
+    chunks = split_chunks(text, args.chunk_size)
+    pattern = re.compile(PATTERNS[1])
+    print('# {} lines, {:.1f} MB, {} chunks of {} characters, {} cores'.format(
+        args.lines, len(text) / 1e6, len(chunks), args.chunk_size, os.cpu_count()))
+    print('masking pattern: {}'.format(pattern.pattern))
+
+    expected = process_inline(pattern, KeywordMatcher(default_patterns(True)), chunks)
+    inline = report('inline', lambda: process_inline(
+        pattern, KeywordMatcher(default_patterns(True)), chunks), text, expected, args.repeat)
+    processes = 1
+    while processes <= args.processes:
+        pool = OutputProcessPool(processes, min_chars=1)
+        matcher = KeywordMatcher(default_patterns(True))
+        pool.configure(pattern, None, matcher)
+        try:
+            # the workers are started by the first chunk
+            process_in_pool(pool, pattern, matcher, chunks[:1])
+            elapsed = report('{} processes'.format(processes), lambda: process_in_pool(
+                pool, pattern, matcher, chunks), text, expected, args.repeat)
+        finally:
+            pool.shutdown()
+        print('  {:<14} {:8.2f}x'.format('speedup', inline / elapsed))
+        processes *= 2
+
+
+def report(name, process, text, expected, repeat):
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        matched = process()
+        elapsed.append(time.perf_counter() - start)
+    same = 'same lines' if matched == expected else 'DIFFERENT lines'
+    print('  {:<14} {:8.3f}s {:8.1f} MB/s ({} keyword lines, {}, best of {})'.format(
+        name, min(elapsed), len(text) / min(elapsed) / 1e6, len(matched), same, repeat))
+    return min(elapsed)
+
+
+if __name__ == '__main__':
+    main()
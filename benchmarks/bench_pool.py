@@ -0,0 +1,80 @@
+"""Time to a ready session with and without a pool of pre-started kernels.
+
+Starts the IPython wrapper kernel through `AsyncLCWrapperMultiKernelManager`
+and measures the time from `start_kernel` until the kernel answers a
+`kernel_info_request`, with `pool_size=0` (cold start) and `pool_size=1`
+(a warm kernel is handed out; the pool is refilled between samples).
+
+    python -m benchmarks.bench_pool [--repeat N]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from jupyter_client.kernelspec import KernelSpecManager
+
+from lc_wrapper.pool import AsyncLCWrapperMultiKernelManager
+
+from tests.helpers import wrapper_kernel_spec
+
+from .utils import format_samples
+
+
+KERNEL_NAME = 'lc_wrapper_benchmark'
+
+
+def install_kernel_spec(kernels_dir):
+    spec = wrapper_kernel_spec()
+    spec.env = {'PYTHONPATH': os.path.dirname(os.path.dirname(os.path.abspath(__file__)))}
+    os.makedirs(os.path.join(kernels_dir, KERNEL_NAME))
+    with open(os.path.join(kernels_dir, KERNEL_NAME, 'kernel.json'), 'w') as f:
+        json.dump(spec.to_dict(), f)
+
+
+async def session_ready(mkm, cwd):
+    start = time.perf_counter()
+    kernel_id = await mkm.start_kernel(kernel_name=KERNEL_NAME, cwd=cwd)
+    kc = mkm.get_kernel(kernel_id).client()
+    kc.start_channels(hb=False)
+    await kc.wait_for_ready(timeout=60)
+    elapsed = time.perf_counter() - start
+    kc.stop_channels()
+    await mkm.shutdown_kernel(kernel_id, now=True)
+    return elapsed
+
+
+async def run(pool_size, repeat, data_dir, cwd):
+    mkm = AsyncLCWrapperMultiKernelManager(
+        kernel_spec_manager=KernelSpecManager(kernel_dirs=[data_dir]),
+        pool_size=pool_size, pool_slot_dir=os.path.join(data_dir, 'slots'))
+    samples = []
+    try:
+        if pool_size:
+            mkm._fill_pool(KERNEL_NAME, cwd)
+        for _ in range(repeat):
+            await asyncio.gather(*mkm._pool_filling.values())
+            samples.append(await session_ready(mkm, cwd))
+    finally:
+        await mkm.shutdown_all(now=True)
+    return samples
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as data_dir, \
+            tempfile.TemporaryDirectory() as cwd:
+        install_kernel_spec(data_dir)
+        for label, pool_size in [('cold start', 0), ('pool_size=1', 1)]:
+            samples = asyncio.run(run(pool_size, args.repeat, data_dir, cwd))
+            print(format_samples(label, samples))
+
+
+if __name__ == '__main__':
+    main()
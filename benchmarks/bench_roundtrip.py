@@ -0,0 +1,60 @@
+"""Request -> reply latency of the wrapper kernel.
+
+Measures kernel_info, complete and execute round trips and the time from
+an interrupt to the execute_reply, through the wrapper (with a proxy
+thread and in async mode, over tcp and ipc) and against the wrapped
+kernel directly.
+
+    python -m benchmarks.bench_roundtrip [--repeat N]
+"""
+
+import argparse
+import time
+
+from .utils import execute, format_samples, measure, start_kernel, thread_count
+
+
+def interrupt(km, kc):
+    msg_id = kc.execute('import time; time.sleep(30)')
+    time.sleep(0.5)
+    start = time.perf_counter()
+    km.interrupt_kernel()
+    kc._recv_reply(msg_id, timeout=30)
+    elapsed = time.perf_counter() - start
+    execute(kc, 'pass')
+    return elapsed
+
+
+def run(km, kc, repeat):
+    results = []
+    results.append(('kernel_info', measure(
+        lambda: kc.kernel_info(reply=True, timeout=30), repeat)))
+    results.append(('complete', measure(
+        lambda: kc.complete('import o', 8, reply=True, timeout=30), repeat)))
+    results.append(('execute', measure(
+        lambda: execute(kc, 'pass'), repeat)))
+    results.append(('interrupt', [interrupt(km, kc)
+                                  for _ in range(max(1, repeat // 20))]))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    for label, kwargs in [('wrapper', {}),
+                          ('wrapper (async mode)',
+                           {'env': {'lc_wrapper_async_mode': '1'}}),
+                          ('wrapper (ipc)',
+                           {'env': {'lc_wrapper_transport': 'ipc'}}),
+                          ('wrapped kernel', {'kernel_name': 'python3'})]:
+        print('# ' + label)
+        with start_kernel(**kwargs) as (km, kc):
+            for name, samples in run(km, kc, args.repeat):
+                print(format_samples(name, samples))
+            print('threads: {}'.format(thread_count(km)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Stream output forwarded by the wrapper kernel.
+
+Runs a cell which flushes stdout after every line, so the wrapped kernel
+sends one stream message per line, and reports how many stream messages
+reach the frontend and how long the cell takes, with and without
+`lc_wrapper_coalesce`.
+
+    python -m benchmarks.bench_stream [--lines N] [--repeat N]
+"""
+
+import argparse
+import time
+
+from .utils import execute, format_samples, start_kernel
+
+
+CODE = '''import sys
+for i in range({lines}):
+    print(i)
+    sys.stdout.flush()
+'''
+
+
+def run(kc, lines):
+    start = time.perf_counter()
+    reply, outputs = execute(kc, CODE.format(lines=lines))
+    elapsed = time.perf_counter() - start
+    streams = [o for o in outputs if o['msg_type'] == 'stream']
+    text = ''.join(o['content']['text'] for o in streams)
+    assert text == ''.join('{}\n'.format(i) for i in range(lines)), 'output changed'
+    return elapsed, len(streams)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    for label, env in [('wrapper', {}),
+                       ('wrapper, lc_wrapper_coalesce=100:65536',
+                        {'lc_wrapper_coalesce': '100:65536'}),
+                       ('wrapper (async mode), lc_wrapper_coalesce=100:65536',
+                        {'lc_wrapper_coalesce': '100:65536',
+                         'lc_wrapper_async_mode': '1'})]:
+        print('# ' + label)
+        with start_kernel(env=env) as (km, kc):
+            execute(kc, 'pass')
+            results = [run(kc, args.lines) for _ in range(args.repeat)]
+        print(format_samples('cell', [elapsed for elapsed, _ in results]))
+        print('stream messages: {}'.format(
+            ', '.join(str(count) for _, count in results)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Output throughput of the wrapper kernel by transport and signature scheme.
+
+Runs cells which send many small stream messages and a few large ones,
+and reports messages and bytes per second received by the frontend, for
+each transport (`lc_wrapper_transport`) and signature scheme
+(`lc_wrapper_signature_scheme`) of the link to the wrapped kernel. The
+frontend link is always signed.
+The cost of signing and verifying one message on that link is measured
+separately, without a kernel.
+
+    python -m benchmarks.bench_throughput [--repeat N]
+"""
+
+import argparse
+import time
+
+from jupyter_client.session import Session
+
+from .utils import execute, format_samples, measure, start_kernel
+
+
+SMALL = '''import sys
+for i in range({count}):
+    print(i)
+    sys.stdout.flush()
+'''
+
+LARGE = '''import sys
+chunk = 'x' * {size} + '\\n'
+for i in range({count}):
+    sys.stdout.write(chunk)
+    sys.stdout.flush()
+'''
+
+WORKLOADS = [
+    ('small', SMALL, {'count': 5000}),
+    ('large', LARGE, {'count': 50, 'size': 1024 * 1024}),
+]
+
+SCHEMES = ['hmac-sha256', 'hmac-sha1', 'none']
+
+LINKS = [
+    ('tcp', 'hmac-sha256'),
+    ('tcp', 'hmac-sha1'),
+    ('ipc', 'hmac-sha256'),
+    ('ipc', 'none'),
+]
+
+
+def run(kc, code):
+    start = time.perf_counter()
+    reply, outputs = execute(kc, code)
+    elapsed = time.perf_counter() - start
+    streams = [o for o in outputs if o['msg_type'] == 'stream']
+    size = sum(len(o['content']['text']) for o in streams)
+    return elapsed, len(streams), size
+
+
+def session_cost(scheme, size, repeat):
+    """Serialize and verify a stream message as the wrapper link does."""
+    if scheme == 'none':
+        session = Session(key=b'')
+    else:
+        session = Session(signature_scheme=scheme)
+    msg = session.msg('stream', {'name': 'stdout', 'text': 'x' * size})
+
+    def roundtrip():
+        msg_list = session.serialize(msg)
+        session.deserialize(msg_list[1:], content=False)
+    return measure(roundtrip, repeat)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print('# serialize + verify one message')
+    for scheme in SCHEMES:
+        for size in [100, 1024 * 1024]:
+            print(format_samples('{} {}B'.format(scheme, size),
+                                 session_cost(scheme, size, 200)))
+
+    for transport, scheme in LINKS:
+        print('# lc_wrapper_transport={} lc_wrapper_signature_scheme={}'.format(
+            transport, scheme))
+        kernel_env = {'lc_wrapper_transport': transport,
+                      'lc_wrapper_signature_scheme': scheme}
+        with start_kernel(env=kernel_env) as (km, kc):
+            execute(kc, 'pass')
+            for name, code, params in WORKLOADS:
+                results = [run(kc, code.format(**params)) for _ in range(args.repeat)]
+                elapsed = min(r[0] for r in results)
+                _, count, size = results[0]
+                print('{:<8} {:8.0f} msgs/s {:8.1f} MB/s ({} msgs, {} bytes, best of {})'.format(
+                    name, count / elapsed, size / elapsed / 1e6, count, size, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Helpers to start a wrapper kernel and measure round trips against it."""
+
+import os
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+
+from jupyter_client.manager import KernelManager
+
+from tests.helpers import wrapper_kernel_spec
+
+
+@contextmanager
+def start_kernel(spec=None, kernel_name=None, env=None, cwd=None):
+    """Start a kernel and yield (km, kc).
+
+    Without `kernel_name`, the kernel described by `spec` (by default the
+    IPython wrapper kernel) is started from this source tree.
+    """
+    work_dir = tempfile.TemporaryDirectory()
+    km = KernelManager()
+    if kernel_name is None:
+        km.kernel_name = 'lc_wrapper_benchmark'
+        km._kernel_spec = spec or wrapper_kernel_spec()
+    else:
+        km.kernel_name = kernel_name
+    kernel_env = dict(os.environ)
+    kernel_env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] +
+        [p for p in [kernel_env.get('PYTHONPATH')] if p])
+    kernel_env.update(env or {})
+    km.start_kernel(cwd=cwd or work_dir.name, env=kernel_env)
+    kc = km.client()
+    kc.start_channels()
+    try:
+        kc.wait_for_ready(timeout=60)
+        yield km, kc
+    finally:
+        kc.stop_channels()
+        km.shutdown_kernel(now=True)
+        work_dir.cleanup()
+
+
+def execute(kc, code, timeout=60):
+    """Execute `code` and wait for the reply and the idle status."""
+    msg_id = kc.execute(code)
+    outputs = []
+    while True:
+        msg = kc.get_iopub_msg(timeout=timeout)
+        if msg['parent_header'].get('msg_id') != msg_id:
+            continue
+        if msg['msg_type'] == 'status' and \
+           msg['content']['execution_state'] == 'idle':
+            break
+        outputs.append(msg)
+    reply = kc._recv_reply(msg_id, timeout=timeout)
+    return reply, outputs
+
+
+def thread_count(km):
+    """Number of threads of the kernel process, or None if unknown."""
+    try:
+        with open('/proc/{}/status'.format(km.provisioner.process.pid)) as f:
+            for line in f:
+                if line.startswith('Threads:'):
+                    return int(line.split()[1])
+    except (AttributeError, OSError):
+        pass
+    return None
+
+
+def measure(func, repeat, warmup=3):
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def format_samples(name, samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return '{:<24} n={:<5d} mean={:8.3f}ms median={:8.3f}ms p95={:8.3f}ms'.format(
+        name, len(samples),
+        statistics.mean(samples) * 1000,
+        statistics.median(samples) * 1000,
+        p95 * 1000)
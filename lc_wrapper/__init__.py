@@ -1,8 +1,28 @@
 """Wrapper Kernel for Literate Computing"""
 
-from .kernel import LCWrapperKernelManager
-from .kernelspec import LCWrapperKernelSpecManager
-from .async_kernelmanager import AsyncLCWrapperKernelManager
+import importlib
+
+# The managers are loaded on first use, so that neither the server side
+# nor the kernel process imports what only the other one needs.
+_lazy_classes = {
+    'LCWrapperKernelManager': '.kernelmanager',
+    'LCWrapperKernelSpecManager': '.kernelspec',
+    'AsyncLCWrapperKernelManager': '.async_kernelmanager',
+    'AsyncLCWrapperMultiKernelManager': '.pool',
+}
+
+
+def __getattr__(name):
+    if name not in _lazy_classes:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    value = getattr(importlib.import_module(_lazy_classes[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_lazy_classes))
+
 
 # nbextension
 def _jupyter_nbextension_paths():
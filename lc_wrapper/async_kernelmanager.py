@@ -1,56 +1,53 @@
-import asyncio
-
-from jupyter_client.session import Session
 from jupyter_client.ioloop import AsyncIOLoopKernelManager
+from jupyter_client.manager import AsyncKernelManager
+from traitlets import Bool, Float
+
+from .kernelmanager import ExecutionStateWatcher
+from .messages import IN_PLACE_RESTART_KEY
 
 
 class AsyncLCWrapperKernelManager(AsyncIOLoopKernelManager):
     """Async Kernel manager for LC_wrapper kernel"""
 
+    in_place_restart = Bool(True, config=True,
+                            help='Restart only the wrapped kernel, keeping the wrapper kernel process.')
+
+    in_place_restart_timeout = Float(60, config=True,
+                                     help='Seconds to wait for the in-place restart before restarting the process.')
+
+    shutdown_wait_time = Float(5.0, config=True,
+                               help='Seconds to wait at most for an interrupted execution to finish before shutting down.')
+
+    started_in_pool = Bool(False, help='The kernel was pre-started by a kernel pool and is not started again.')
+
+    _state_watcher = None
+
     async def start_kernel(self, **kw):
+        if self.started_in_pool:
+            # handed out by KernelPoolMixin; restarts start a new kernel
+            self.started_in_pool = False
+            return
         await super(AsyncLCWrapperKernelManager, self).start_kernel(**kw)
 
         self.start_watching_execution_state()
 
     def start_watching_execution_state(self):
-        self._executing = False
-
-        self._watch_state_stream = self.connect_iopub()
-        session = Session(
-            config=self.session.config,
-            key=self.session.key,
-        )
-
-        def record_state(msg_list):
-            idents, fed_msg_list = session.feed_identities(msg_list)
-            msg = session.deserialize(fed_msg_list)
-
-            msg_type = msg['header']['msg_type']
-            if msg_type == 'status':
-                execution_state = msg['content']['execution_state']
-                self.log.debug("kernel_state : %s (%s)", msg_type, execution_state)
-                parent_msg_type = msg['parent_header'].get('msg_type', '')
-                parent_msg_id = msg['parent_header'].get('msg_id', '')
-                if parent_msg_type == 'execute_request':
-                    if execution_state == 'busy':
-                        self.log.debug("start execution: msg_id=%s", parent_msg_id)
-                        self._executing = True
-                    elif execution_state == 'idle':
-                        self.log.debug("end execution: msg_id=%s", parent_msg_id)
-                        self._executing = False
-
-        self._watch_state_stream.on_recv(record_state)
+        self.stop_watching_execution_state()
+        self._state_watcher = ExecutionStateWatcher(self)
+
+    def stop_watching_execution_state(self):
+        if self._state_watcher is not None:
+            self._state_watcher.close()
+            self._state_watcher = None
 
     async def _wait_for_idle(self):
-        waittime = 5.0
-        pollinterval = 0.1
-        for i in range(int(waittime/pollinterval)):
-            self.log.debug("waiting for kernel to become idle")
-            if self._executing:
-                await asyncio.sleep(pollinterval)
-            else:
-                self.log.debug("kernel become idle")
-                break
+        if self._state_watcher is None:
+            return
+        self.log.debug("waiting for kernel to become idle")
+        if await self._state_watcher.wait_for_idle(self.shutdown_wait_time):
+            self.log.debug("kernel become idle")
+        else:
+            self.log.debug("kernel did not become idle in %.1fs", self.shutdown_wait_time)
 
     async def shutdown_kernel(self, now=False, restart=False):
         # Stop monitoring for restarting while we shutdown.
@@ -59,10 +56,7 @@ class AsyncLCWrapperKernelManager(AsyncIOLoopKernelManager):
         self.log.debug("Interrupting the wrapper kernel and its subprocesses")
         await self.interrupt_kernel()
         await self._wait_for_idle()
-
-        if self._watch_state_stream:
-            self._watch_state_stream.close()
-            self._watch_state_stream = None
+        self.stop_watching_execution_state()
 
         if now:
             await self._kill_kernel()
@@ -75,3 +69,29 @@ class AsyncLCWrapperKernelManager(AsyncIOLoopKernelManager):
 
         await self.cleanup_resources(restart=restart)
 
+    async def restart_kernel(self, now=False, newports=False, **kw):
+        if self.in_place_restart and not now and not newports and not kw:
+            if await self._restart_in_place():
+                return
+        await super(AsyncLCWrapperKernelManager, self).restart_kernel(
+            now=now, newports=newports, **kw)
+        # a new process, possibly on new ports
+        self.start_watching_execution_state()
+
+    async def _restart_in_place(self):
+        # a socket of its own: the replies to request_shutdown() are
+        # never read from the control socket of the manager
+        socket = AsyncKernelManager.connect_control(self)
+        try:
+            msg = self.session.msg('shutdown_request',
+                                   {'restart': True, IN_PLACE_RESTART_KEY: True})
+            self.session.send(socket, msg)
+            if not await socket.poll(self.in_place_restart_timeout * 1000):
+                self.log.warning("In-place restart timed out")
+                return False
+            idents, msg_list = self.session.feed_identities(await socket.recv_multipart())
+            reply = self.session.deserialize(msg_list)
+        finally:
+            socket.close(linger=0)
+        content = reply['content']
+        return content.get('status') == 'ok' and content.get(IN_PLACE_RESTART_KEY, False)
@@ -9,6 +9,8 @@ class BashKernelBuffered(BufferedKernelBase):
         'name': 'bash'
     }
     banner = 'Literate Computing Wrapper Kernel(Bash)'
+    # bash_kernel completes in the bash process which runs the cell
+    empty_reply_msg_types = ['complete_request']
 
     def _get_wrapped_kernel_name(self):
         return 'bash'
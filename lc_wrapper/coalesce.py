@@ -0,0 +1,71 @@
+import threading
+import time
+
+
+class StreamCoalescer(object):
+    """Merge consecutive stream messages of the same name and parent.
+
+    Held messages are sent as one message through `send(parent_header,
+    msg, content)` when `interval` seconds passed since the first of them,
+    when `max_bytes` characters of text are held, when a message which
+    cannot be merged arrives, or when `flush()` is called. The merged
+    message keeps the header and metadata of the first message.
+    """
+
+    def __init__(self, send, interval=0.1, max_bytes=65536, clock=time.monotonic):
+        self.send = send
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.deadline = None
+        self.received = 0
+        self.sent = 0
+
+        self._lock = threading.Lock()
+        self._parent_header = None
+        self._msg = None
+        self._content = None
+        self._texts = []
+        self._size = 0
+
+    def add(self, parent_header, msg, content):
+        with self._lock:
+            self.received += 1
+            if self._msg is not None and \
+               (self._parent_header['msg_id'] != parent_header['msg_id'] or
+                self._content['name'] != content['name']):
+                self._flush()
+            if self._msg is None:
+                self._parent_header = parent_header
+                self._msg = msg
+                self._content = content
+                self.deadline = self.clock() + self.interval
+            self._texts.append(content['text'])
+            self._size += len(content['text'])
+            if self._size >= self.max_bytes or self.clock() >= self.deadline:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def flush_expired(self):
+        with self._lock:
+            if self.deadline is not None and self.clock() >= self.deadline:
+                self._flush()
+
+    def _flush(self):
+        if self._msg is None:
+            return
+        content = dict(self._content)
+        content['text'] = u''.join(self._texts)
+        self.sent += 1
+        try:
+            self.send(self._parent_header, self._msg, content)
+        finally:
+            self._parent_header = None
+            self._msg = None
+            self._content = None
+            self._texts = []
+            self._size = 0
+            self.deadline = None
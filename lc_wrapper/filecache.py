@@ -0,0 +1,36 @@
+import os
+
+
+class FileCache(object):
+    """Cache what is loaded from files, keyed by path, mtime and size.
+
+    `get()` stats the file, unless given its stat result `st`, and calls
+    `load(path)` only when the file is new or has changed since the last
+    call. A missing file is not loaded and gives `default`. Errors raised
+    by `load` are not cached.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+
+    def get(self, path, load, default=None, st=None):
+        if st is None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                self._entries.pop(path, None)
+                return default
+        key = (st.st_mtime_ns, st.st_size, st.st_ino)
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        value = load(path)
+        self._entries[path] = (key, value)
+        return value
+
+    def clear(self):
+        self._entries.clear()
@@ -1,40 +1,58 @@
-from queue import Empty
+import asyncio
+import concurrent.futures
+from contextlib import contextmanager
+import errno
+import inspect
+import math
 import time
 import io
-from collections.abc import Mapping
+from collections import deque
 
 from ipykernel.kernelbase import Kernel
 from datetime import datetime
 import os
 import os.path
 import tempfile
-from jupyter_client.manager import KernelManager
-from jupyter_client.ioloop import IOLoopKernelManager
-from jupyter_core.application import JupyterApp
+from jupyter_client.manager import AsyncKernelManager, KernelManager
+from jupyter_core.paths import jupyter_data_dir, jupyter_runtime_dir
+from jupyter_core.utils import ensure_dir_exists
 import re
 import json
-from threading import (Thread, Event, Timer)
+import shutil
+import signal
+import threading
+from threading import (Thread, Timer)
+import zmq
+import zmq.asyncio
 
 from os import getcwd
-import pickle
-import dateutil
+from .coalesce import StreamCoalescer
+from .filecache import FileCache
+from .keywords import KeywordMatcher, superlinear_reason
+from .masking import LiteralMatcher, StreamMasker, mask_text
 from .log import ExecutionInfo
-from .utils import run_sync
+from .messages import IN_PLACE_RESTART_KEY
+from .rate import OutputRateMeter
 
-from traitlets.config.configurable import LoggingConfigurable, MultipleInstanceError
+from traitlets.config.configurable import LoggingConfigurable
 from traitlets import (
-    Unicode, List, default
+    Bool, Enum, Integer, Unicode, List, TraitError, default
 )
 from types import MethodType
-from fluent import sender
-
-RECV_REPLY_TIMEOUT = 1
 
 SUMMARIZE_KEY = 'lc_wrapper'
 IGNORE_SUMMARIZE_KEY = 'lc_wrapper_regex'
 FORCE_SUMMARIZE_KEY = 'lc_wrapper_force'
 MASKING_KEY = 'lc_wrapper_masking_pattern'
+MASKING_FILE_KEY = 'lc_wrapper_masking_file'
+COALESCE_KEY = 'lc_wrapper_coalesce'
+AUTO_SUMMARIZE_KEY = 'lc_wrapper_auto_summarize'
 LOG_MASKING_KEY = 'lc_wrapper_mask_log'
+REGEX_GUARD_KEY = 'lc_wrapper_regex_guard'
+# the variables of the environment which override the config file
+CONFIG_KEYS = [SUMMARIZE_KEY, IGNORE_SUMMARIZE_KEY, FORCE_SUMMARIZE_KEY, MASKING_KEY,
+               MASKING_FILE_KEY, COALESCE_KEY, AUTO_SUMMARIZE_KEY, LOG_MASKING_KEY,
+               REGEX_GUARD_KEY]
 
 IPYTHON_DEFAULT_PATTERN_FILE = '.lc_wrapper_regex.txt'
 IPYTHON_DEFAULT_PATTERN = '''ERROR|error|Error|Panic|panic|Invalid|invalid|Warning|warning|Bad|bad
@@ -56,107 +74,120 @@ refuse(d)?|insufficient|lack
 link(ed)? (up|down)'''
 
 
-class ChannelReaderThread(Thread, LoggingConfigurable):
+def __getattr__(name):
+    # LCWrapperKernelManager is also importable from here, but loads the
+    # ioloop managers which the kernel process does not need
+    if name != 'LCWrapperKernelManager':
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    from .kernelmanager import LCWrapperKernelManager
+    return LCWrapperKernelManager
 
-    _exiting = False
 
-    def __init__(self, kernel, client, stream, session, channel, **kwargs):
-        Thread.__init__(self, **kwargs)
+class ChannelProxy(LoggingConfigurable):
+    """Forward messages between the wrapped kernel and the frontend.
+
+    Subclasses read the sockets of the wrapped kernel and the stdin socket
+    of the frontend, and pass each received message to its handler.
+    Replies are handed to the kernel by msg_id.
+    """
+
+    def __init__(self, kernel, client, session, **kwargs):
         LoggingConfigurable.__init__(self, **kwargs)
 
-        self.daemon = True
-        self.channel_name = channel
-        self.channel = getattr(client, channel + "_channel")
         self.kernel = kernel
         self.client = client
-        self.stream = stream
         self.session = session
 
-        self.log.debug("init ChannelReaderThread: channel_name=%s",
-                       self.channel_name)
-
-    def run(self):
-        self.log.debug("start ChannelReaderThread: channel_name=%s",
-                       self.channel_name)
+    def _channel_handlers(self):
+        handlers = []
+        for channel in self.kernel.proxy_channles:
+            socket = getattr(self.client, channel + '_channel').socket
+            handlers.append((socket, getattr(self, '_handle_%s_msg' % channel)))
+        if self.kernel.stdin_socket is not None:
+            handlers.append((self.kernel.stdin_socket, self._handle_input_reply))
+        return handlers
+
+    def _deserialize(self, session, msg_list):
+        ident, smsg = session.feed_identities(msg_list)
+        return session.deserialize(smsg)
+
+    def _handle_iopub_msg(self, msg_list):
+        session = self.client.session
+        ident, smsg = session.feed_identities(msg_list)
+        # leave the content packed until we know it has to be inspected
+        msg = session.deserialize(smsg, content=False)
+        self.log.debug("Received iopub message: header=%s, parent_header=%s",
+                       msg['header'], msg['parent_header'])
+
+        msg_type = msg['msg_type']
+        idle = False
+        if msg_type == 'status':
+            msg['content'] = session.unpack(msg['content'])
+            if msg['content']['execution_state'] == 'idle':
+                idle = True
+
+        if msg['parent_header'].get('msg_type') == 'shutdown_request':
+            return
 
-        get_msg = getattr(self.client, 'get_%s_msg' % self.channel_name)
+        msg_id = msg['parent_header'].get('msg_id')
+        parent_header = self.kernel.parent_headers.get(msg_id)
+        self.log.debug("parent_header: %s", parent_header)
+
+        if parent_header is None:
+            if msg_type != 'status':
+                # e.g. the output of a thread after its request finished
+                self.kernel._flush_stream_msgs()
+                msg['content'] = session.unpack(msg['content'])
+                self.kernel._send_iopub_msg_of_no_request(msg, msg['content'])
+        elif msg_type == 'status':
+            pass
+        elif self.kernel._can_forward_raw_iopub_msg(parent_header, msg):
+            self.kernel._flush_stream_msgs()
+            # forward the original metadata, content and buffer frames;
+            # only the parent header is replaced and the message re-signed
+            self.session.send_raw(self.kernel.iopub_socket,
+                                  [smsg[1],
+                                   self.session.pack(parent_header),
+                                   smsg[3],
+                                   smsg[4]] + smsg[5:],
+                                  ident=self.kernel._topic(msg_type))
+        else:
+            msg['content'] = session.unpack(msg['content'])
+            content = self.kernel._hook_iopub_msg(parent_header, msg)
+            if content is not None:
+                self.kernel._send_iopub_msg(parent_header, msg, content)
 
-        while True:
-            try:
-                msg = get_msg(timeout=0.2)
-                self.log.debug("Received %s message: %s",
-                               self.channel_name, str(msg))
-
-                msg_type = msg['msg_type']
-                idle = False
-                status_msg = False
-
-                if self.channel_name == 'iopub':
-                    content = msg['content']
-                    if msg_type == 'status':
-                        status_msg = True
-                        if content['execution_state'] == 'idle':
-                            self.kernel.idle_parent_header = msg['parent_header']
-                            idle = True
-
-                if msg['parent_header']['msg_type'] == 'shutdown_request':
-                    continue
+        if idle:
+            self.kernel._flush_stream_msgs()
+            self.kernel._dispatch_idle(msg_id)
+            self.kernel._remove_parent_header(msg_id)
 
-                msg_id = msg['parent_header']['msg_id']
-                parent_header = self.kernel.parent_headers.get(msg_id)
-                self.log.debug("parent_header: %s", str(parent_header))
+    def _handle_shell_msg(self, msg_list):
+        self.kernel._dispatch_reply(self._deserialize(self.client.session, msg_list))
 
-                if self.channel_name == 'iopub':
-                    ident = self.kernel._topic(msg_type)
-                    msg_content = self.kernel._hook_iopub_msg(parent_header, msg)
-                else:
-                    ident = self._get_kernel_parent_ident()
-                    msg_content = msg['content']
-
-                if not status_msg:
-                    self.session.send(self.stream,
-                                      msg_type,
-                                      msg_content,
-                                      parent=parent_header,
-                                      ident=ident,
-                                      header=msg['header'],
-                                      metadata=msg['metadata'],
-                                      buffers=msg['buffers'])
-
-                if self.channel_name == 'stdin' and msg_type == 'input_request':
-                    self.log.debug("do input_request")
-                    self.input_request()
-
-                if idle:
-                    self.kernel.idle_event.set()
-                    parent_msg_id = msg['parent_header'].get('msg_id')
-                    if parent_msg_id is not None:
-                        self.kernel._remove_parent_header(parent_msg_id)
-            except Empty as e:
-                pass
-            except Exception as e:
-                self.log.error(e, exc_info=True)
-            finally:
-                if self._exiting:
-                    break
+    _handle_control_msg = _handle_shell_msg
 
-        self.log.debug("exit ChannelReaderThread: %s", self.channel_name)
+    def _handle_stdin_msg(self, msg_list):
+        msg = self._deserialize(self.client.session, msg_list)
+        self.log.debug("Received stdin message: %s", msg)
 
-    def input_request(self):
-        self.log.debug("wait input_reply")
-        while True:
-            try:
-                reply = self._get_msg_from_frontend()
-            except Empty:
-                if self.kernel.keyboard_interrupt:
-                    self.log.debug("input_request: interrupted")
-                    return
-            except Exception:
-                self.log.warn("Invalid Message:", exc_info=True)
-            else:
-                break
+        if msg['parent_header'].get('msg_type') == 'shutdown_request':
+            return
 
-        self.log.debug("input_reply: %s", str(reply))
+        msg_id = msg['parent_header'].get('msg_id')
+        parent_header = self.kernel.parent_headers.get(msg_id)
+        self.session.send(self.kernel.stdin_socket,
+                          msg['msg_type'],
+                          msg['content'],
+                          parent=parent_header,
+                          ident=self.kernel.parent_idents.get(msg_id),
+                          header=msg['header'],
+                          metadata=msg['metadata'],
+                          buffers=msg['buffers'])
+
+    def _handle_input_reply(self, msg_list):
+        reply = self._deserialize(self.session, msg_list)
+        self.log.debug("input_reply: %s", reply)
         msg = self.client.session.msg(reply['msg_type'],
                                       content=reply['content'],
                                       parent=reply['parent_header'],
@@ -164,28 +195,169 @@ class ChannelReaderThread(Thread, LoggingConfigurable):
                                       metadata=reply['metadata'])
         self.client.stdin_channel.send(msg)
 
-    def _get_msg_from_frontend(self, timeout=200):
-        ready = self.stream.poll(timeout)
-        if ready:
-            return self._recv_from_frontend()
-        else:
-            raise Empty
+    def _flush_delay(self):
+        """Seconds until held stream messages or text have to be sent, or None."""
+        delays = []
+        coalescer = self.kernel.stream_coalescer
+        if coalescer is not None and coalescer.deadline is not None:
+            delays.append(coalescer.deadline - coalescer.clock())
+        deadline = self.kernel.masked_stream_deadline
+        if deadline is not None:
+            delays.append(deadline - time.monotonic())
+        if len(delays) == 0:
+            return None
+        return max(0.0, min(delays))
+
+    def _flush_expired_stream_msgs(self):
+        self.kernel._flush_expired_masked_stream_text()
+        coalescer = self.kernel.stream_coalescer
+        if coalescer is not None:
+            coalescer.flush_expired()
+
+
+class ChannelProxyThread(Thread, ChannelProxy):
+    """Forward messages on a dedicated thread.
+
+    A single thread multiplexes the sockets with a zmq poller, so it sleeps
+    until a message arrives instead of waking up periodically. It owns the
+    sockets of the wrapped kernel: other threads pass the requests to
+    send through `send()`.
+    """
+
+    _exiting = False
+
+    def __init__(self, kernel, client, session, **kwargs):
+        Thread.__init__(self)
+        ChannelProxy.__init__(self, kernel, client, session, **kwargs)
+
+        self.daemon = True
+
+        self.poller = zmq.Poller()
+        self.handlers = {}
+        for socket, handler in self._channel_handlers():
+            self._register(socket, handler)
+        self.log.debug("init ChannelProxyThread: channels=%s",
+                       kernel.proxy_channles)
+
+        # send() and stop() write to this pair to wake up the poller
+        self._outgoing = deque()
+        self._waker_lock = threading.Lock()
+        context = client.context
+        address = 'inproc://lc_wrapper-proxy-waker-%x' % id(self)
+        self._waker_recv = context.socket(zmq.PAIR)
+        self._waker_recv.bind(address)
+        self._waker_send = context.socket(zmq.PAIR)
+        self._waker_send.connect(address)
+        self._register(self._waker_recv, None)
+
+    def _register(self, socket, handler):
+        self.poller.register(socket, zmq.POLLIN)
+        self.handlers[socket] = handler
 
-    def _recv_from_frontend(self, **kwargs):
-        msg = self.stream.recv_multipart(**kwargs)
-        ident,smsg = self.session.feed_identities(msg)
-        return self.session.deserialize(smsg)
+    def run(self):
+        self.log.debug("start ChannelProxyThread")
+
+        while not self._exiting:
+            delay = self._flush_delay()
+            try:
+                events = self.poller.poll(None if delay is None else math.ceil(delay * 1000))
+            except zmq.ZMQError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                self.log.error(e, exc_info=True)
+                break
+            for socket, _ in events:
+                handler = self.handlers[socket]
+                if handler is None:
+                    self._send_outgoing_msgs()
+                    continue
+                try:
+                    handler(socket.recv_multipart())
+                except Exception as e:
+                    self.log.error(e, exc_info=True)
+            self._flush_expired_stream_msgs()
 
-    def _get_kernel_parent_ident(self):
-        ident = self.kernel._parent_ident
-        if isinstance(ident, Mapping):
-            return ident['shell']
-        return ident
+        self.log.debug("exit ChannelProxyThread")
+
+    def send(self, channel, msg):
+        """Send a message to the wrapped kernel from any thread."""
+        self._outgoing.append((channel, msg))
+        self._wake()
+
+    def _wake(self):
+        with self._waker_lock:
+            self._waker_send.send(b'')
+
+    def _send_outgoing_msgs(self):
+        while True:
+            try:
+                self._waker_recv.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+        while self._outgoing:
+            channel, msg = self._outgoing.popleft()
+            getattr(self.client, channel + '_channel').send(msg)
 
     def stop(self):
         if self.is_alive():
             self._exiting = True
+            self._wake()
             self.join()
+        self._waker_send.close(linger=0)
+        self._waker_recv.close(linger=0)
+
+
+class AsyncChannelProxy(ChannelProxy):
+    """Forward messages on the event loop of the kernel.
+
+    The client must be an `AsyncKernelClient`. Each socket is read by a
+    task, so no thread is involved; `send()` and `stop()` must be called
+    on the same event loop.
+    """
+
+    _tasks = None
+    _flush_handle = None
+
+    def start(self):
+        self.log.debug("start AsyncChannelProxy")
+        self._tasks = []
+        for socket, handler in self._channel_handlers():
+            if not isinstance(socket, zmq.asyncio.Socket):
+                socket = zmq.asyncio.Socket.shadow(socket.underlying)
+            self._tasks.append(asyncio.ensure_future(self._forward(socket, handler)))
+
+    async def _forward(self, socket, handler):
+        while True:
+            msg_list = await socket.recv_multipart()
+            try:
+                handler(msg_list)
+            except Exception as e:
+                self.log.error(e, exc_info=True)
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        delay = self._flush_delay()
+        if delay is None or self._flush_handle is not None:
+            return
+        self._flush_handle = asyncio.get_running_loop().call_later(delay, self._flush)
+
+    def _flush(self):
+        self._flush_handle = None
+        self._flush_expired_stream_msgs()
+        self._schedule_flush()
+
+    def send(self, channel, msg):
+        """Send a message to the wrapped kernel."""
+        getattr(self.client, channel + '_channel').send(msg)
+
+    def stop(self):
+        for task in self._tasks or []:
+            task.cancel()
+        self._tasks = None
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self.log.debug("stop AsyncChannelProxy")
 
 
 class BufferedKernelBase(Kernel):
@@ -199,13 +371,26 @@ class BufferedKernelBase(Kernel):
         'comm_info_request',
         'shutdown_request'
     ]
-    proxy_channles = ['iopub', 'stdin']
-
-    threads = {}
+    # requests answered while another shell request is running
+    concurrent_msg_types = [
+        'complete_request',
+        'inspect_request',
+        'comm_info_request'
+    ]
+    # concurrent requests the wrapped kernel cannot serve while it is busy;
+    # the wrapper answers them with an empty result
+    empty_reply_msg_types = []
+    proxy_channles = ['iopub', 'stdin', 'shell', 'control']
+    # content fields of iopub messages which may carry the msg_id of a
+    # request, e.g. the Output widget captures the outputs of a request
+    msg_id_content_fields = {
+        'comm_open': [('data', 'state', 'msg_id')],
+        'comm_msg': [('data', 'state', 'msg_id')],
+    }
+
+    proxy = None
 
     parent_headers = {}
-    idle_event = Event()
-    idle_parent_header = None
 
     keyboard_interrupt = False
 
@@ -213,20 +398,17 @@ class BufferedKernelBase(Kernel):
 
     log_file_object = None
 
+    summarize_on = False
+
+    runtime_dir = None
+
+    stream_coalescer = None
+    output_rate_meter = None
+
     data_dir = Unicode()
     @default('data_dir')
     def _data_dir_default(self):
-        app = None
-        try:
-            if JupyterApp.initialized():
-                app = JupyterApp.instance()
-        except MultipleInstanceError:
-            pass
-        if app is None:
-            # create an app, without the global instance
-            app = JupyterApp()
-            app.initialize(argv=[])
-        return app.data_dir
+        return jupyter_data_dir()
 
     server_signature_file = Unicode(
         help="""The file where the server signature is stored."""
@@ -239,6 +421,81 @@ class BufferedKernelBase(Kernel):
             return ''
         return os.path.join(self.data_dir, 'server_signature')
 
+    async_mode = Bool(
+        help="""Drive the wrapped kernel with an AsyncKernelManager on the
+        event loop of this kernel instead of a proxy thread."""
+    ).tag(config=True)
+    @default('async_mode')
+    def _async_mode_default(self):
+        return os.environ.get('lc_wrapper_async_mode', '').lower() in ('1', 'on', 'true')
+
+    wrapped_kernel_signature_scheme = Unicode(
+        help="""The signature scheme of the messages between this kernel and
+        the wrapped kernel, e.g. hmac-sha256 or hmac-md5. 'none' does not
+        sign them, which is only allowed when the wrapped kernel is
+        connected with ipc sockets in a directory only the user can access.
+        The messages to the frontend are always signed."""
+    ).tag(config=True)
+    @default('wrapped_kernel_signature_scheme')
+    def _wrapped_kernel_signature_scheme_default(self):
+        return os.environ.get('lc_wrapper_signature_scheme', 'hmac-sha256')
+
+    wrapped_kernel_transport = Enum(
+        ['tcp', 'ipc'],
+        help="""The transport of the connection to the wrapped kernel. With
+        ipc, the sockets and the connection file are created in a private
+        directory under the Jupyter runtime directory."""
+    ).tag(config=True)
+    @default('wrapped_kernel_transport')
+    def _wrapped_kernel_transport_default(self):
+        return os.environ.get('lc_wrapper_transport', 'tcp')
+
+    masking_carry_over = Integer(
+        help="""The maximum number of characters at the end of a stream
+        message held back until the next one, because they may be the
+        start of a secret matched by lc_wrapper_masking_pattern or listed in
+        lc_wrapper_masking_file."""
+    ).tag(config=True)
+    @default('masking_carry_over')
+    def _masking_carry_over_default(self):
+        return int(os.environ.get('lc_wrapper_masking_carry_over', '1024'))
+
+    masking_carry_over_time = Integer(
+        help="""The maximum time in milliseconds the characters held back by
+        masking_carry_over wait for the next stream message, so that a line
+        rewritten with '\\r', e.g. a progress bar, is still shown."""
+    ).tag(config=True)
+    @default('masking_carry_over_time')
+    def _masking_carry_over_time_default(self):
+        return int(os.environ.get('lc_wrapper_masking_carry_over_time', '200'))
+
+    concurrent_reply_timeout = Integer(
+        help="""The time in milliseconds to wait for the wrapped kernel to reply
+        to a complete, inspect or comm_info request sent on its control
+        channel while a cell runs, before the request is answered with an
+        empty result."""
+    ).tag(config=True)
+    @default('concurrent_reply_timeout')
+    def _concurrent_reply_timeout_default(self):
+        return int(os.environ.get('lc_wrapper_concurrent_reply_timeout', '5000'))
+
+    output_processes = Integer(
+        help="""The number of worker processes which mask and scan for keywords
+        the lines of large stream messages, or 0 to process them in the
+        kernel."""
+    ).tag(config=True)
+    @default('output_processes')
+    def _output_processes_default(self):
+        return int(os.environ.get('lc_wrapper_output_processes', '0'))
+
+    output_process_min_chars = Integer(
+        help="""The number of characters from which a stream message is
+        processed by the worker processes of output_processes."""
+    ).tag(config=True)
+    @default('output_process_min_chars')
+    def _output_process_min_chars_default(self):
+        return int(os.environ.get('lc_wrapper_output_process_min_chars', '65536'))
+
     keyword_pattern_file_paths = List()
     @default('keyword_pattern_file_paths')
     def _keyword_pattern_file_paths_default(self):
@@ -264,9 +521,11 @@ class BufferedKernelBase(Kernel):
         ]
 
     def __init__(self, **kwargs):
+        self._init_time = time.monotonic()
         Kernel.__init__(self, **kwargs)
 
         if 'lc_wrapper_fluentd_host' in os.environ:
+            from fluent import sender
             fluentd_host = os.environ['lc_wrapper_fluentd_host']
             fluentd_port = int(os.environ.get('lc_wrapper_fluentd_port', '24224'))
             fluentd_tag = os.environ.get('lc_wrapper_fluentd_tag', 'lc_wrapper')
@@ -278,50 +537,124 @@ class BufferedKernelBase(Kernel):
         else:
             self.sender = None
 
+        self._shell_busy = False
+        self._shell_request_lock = asyncio.Lock()
+        self.reply_futures = {}
+        self.idle_futures = {}
+        self.idle_waits = 0
+        self.idle_wait_time = 0.0
+        self._wrapped_kernel_started = None
+        self._wrapped_kernel_restarting = None
+        self._log_settings_ready = None
+        self.parent_idents = {}
+        self.exec_info = None
+        self._config_cache = FileCache()
+        self._keyword_pattern_cache = FileCache()
+        self._server_signature_cache = FileCache()
+        self._masking_file_cache = FileCache()
+        self.keyword_matcher = None
+        self.keyword_guard = None
+        self._keyword_lines_over_budget = 0
+        self._superlinear_reasons = {}
+        self.stream_maskers = {}
+        self.masked_stream_deadline = None
+        self.output_pool = None
+        self.notebook_path = self.get_notebook_path()
+        self.log.debug('notebook_path: %s', self.notebook_path)
+
         self._init_message_handler()
-        self.start_ipython_kernel()
+
+    def start(self):
+        super(BufferedKernelBase, self).start()
+        self._start_background_startup(self.io_loop.asyncio_loop)
+        self.log.info('startup: accepting requests in %.3fs', time.monotonic() - self._init_time)
+
+    def _start_background_startup(self, loop):
+        """Start the wrapped kernel and look up the log settings concurrently.
+
+        Requests wait for what they need in `_wait_for_wrapped_kernel()` and
+        `_wait_for_log_settings()`.
+        """
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix='lc_wrapper-startup')
+        self._log_settings_ready = executor.submit(self._init_log_settings)
+        if self.async_mode:
+            self._wrapped_kernel_started = asyncio.run_coroutine_threadsafe(
+                self.start_ipython_kernel_async(), loop)
+        else:
+            self._wrapped_kernel_started = executor.submit(self.start_ipython_kernel)
+        executor.shutdown(wait=False)
+
+        def startup_done(future):
+            if future.exception() is not None:
+                self.log.error('startup failed', exc_info=future.exception())
+                loop.call_soon_threadsafe(loop.stop)
+            elif self._wrapped_kernel_started.done() and self._log_settings_ready.done():
+                self.log.info('startup: completed in %.3fs', time.monotonic() - self._init_time)
+        self._log_settings_ready.add_done_callback(startup_done)
+        self._wrapped_kernel_started.add_done_callback(startup_done)
 
     def _init_message_handler(self):
 
-        def handler(self, stream, ident, parent):
+        async def handler(self, stream, ident, parent):
             self.log.debug("Received shell message: %s", str(parent))
 
-            msg_type = parent['msg_type']
-            content = parent['content']
+            with self._abort_on_sigint() as interrupted:
+                await self._wait_for_wrapped_kernel()
+                if parent['msg_type'] == 'execute_request':
+                    await self._wait_for_log_settings()
+            if interrupted.is_set():
+                self._send_abort_reply(stream, parent, ident)
+                return
+            async with self._shell_request_lock:
+                self._shell_busy = True
+                try:
+                    await self._handle_shell_msg(stream, ident, parent)
+                finally:
+                    self._shell_busy = False
+
+        for msg_type in self.msg_types:
+            if msg_type == 'kernel_info_request':
+                continue
+            if msg_type == 'shutdown_request':
+                continue
+
+            self.log.debug('override shell message handler: msg_type=%s', msg_type)
+
+            setattr(self, msg_type, MethodType(handler, self))
+            self.shell_handlers[msg_type] = getattr(self, msg_type)
+
+        comm_msg_types = ['comm_open', 'comm_msg', 'comm_close']
+        for msg_type in comm_msg_types:
+            self.log.debug('init shell comm message handler: msg_type=%s', msg_type)
+
+            setattr(self, msg_type, MethodType(handler, self))
+            self.shell_handlers[msg_type] = getattr(self, msg_type)
+
+    async def _handle_shell_msg(self, stream, ident, parent):
+        msg_type = parent['msg_type']
+        content = parent['content']
 
-            self._hook_request_msg(parent)
-
-            self.idle_event.clear()
-            self.keyboard_interrupt = False
-
-            msg = self.kc.session.msg(msg_type, content)
-            msgid = msg['header']['msg_id']
-            self.log.debug("save parent_header: %s => %s", msgid, str(parent['header']))
-            self.parent_headers[msgid] = parent['header']
-
-            self.kc.shell_channel.send(msg)
-
-            reply_msg = None
-            if msg_type in self.blocking_msg_types:
-                while True:
-                    try:
-                        # Since _recv_reply does not terminate when KeyboardInterrupt occurs
-                        # (because event loop is a different thread from the main thread),
-                        # specify timeout to stop it periodically.
-                        reply_msg = self.kc._recv_reply(msgid, timeout=RECV_REPLY_TIMEOUT)
-                        break
-                    except TimeoutError:
-                        pass
-                    except KeyboardInterrupt:
-                        self.log.debug("KeyboardInterrupt", exc_info=True)
-                        # propagate SIGINT to wrapped kernel
-                        self.km.interrupt_kernel()
-                        self.keyboard_interrupt = True
-
-                        # this timer fire when the ipython kernel didnot interrupt within 5.0 sec.
-                        self.timer = Timer(5.0, self.close_files)
-                        self.log.debug('>>>>> close files: timer fired')
-                        self.timer.start()
+        self._hook_request_msg(parent)
+
+        self.keyboard_interrupt = False
+
+        msg = self.kc.session.msg(msg_type, content)
+        msgid = msg['header']['msg_id']
+        self.log.debug("save parent_header: %s => %s", msgid, str(parent['header']))
+        self.parent_headers[msgid] = parent['header']
+        # input requests of the wrapped kernel are routed by the identity
+        # of the frontend which sent this request
+        self.parent_idents[msgid] = ident
+        idle_future = self._expect_idle(msgid)
+
+        blocking = msg_type in self.blocking_msg_types
+        reply_future = self._send_to_wrapped_kernel('shell', msg, reply=blocking)
+
+        reply_msg = None
+        with self._interrupt_wrapped_kernel_on_sigint():
+            if blocking:
+                reply_msg = await reply_future
 
                 reply_msg_content = self._hook_reply_msg(reply_msg)
 
@@ -334,37 +667,190 @@ class BufferedKernelBase(Kernel):
                                               metadata=reply_msg['metadata'],
                                               buffers=reply_msg['buffers'])
 
-                self._post_send_reply_msg(parent, reply_msg)
+                await self._post_send_reply_msg(parent, reply_msg)
 
-            self._wait_for_idle(msgid)
-            self._post_wait_for_idle(parent, reply_msg)
+            await self._wait_for_idle(msgid, idle_future)
+        self._post_wait_for_idle(parent, reply_msg)
 
-        for msg_type in self.msg_types:
-            if msg_type == 'kernel_info_request':
-                continue
-            if msg_type == 'shutdown_request':
-                continue
+    async def shell_main(self, subshell_id, msg):
+        # ipykernel >= 7 runs one shell message at a time per subshell
+        if self._is_concurrent_shell_msg(msg):
+            await self._dispatch_concurrent_shell_msg(msg, subshell_id)
+            return
+        await super(BufferedKernelBase, self).shell_main(subshell_id, msg)
 
-            self.log.debug('override shell message handler: msg_type=%s', msg_type)
+    def schedule_dispatch(self, dispatch, *args):
+        # ipykernel 6 queues every shell message
+        if dispatch == self.dispatch_shell and self._is_concurrent_shell_msg(args[0]):
+            self.io_loop.add_callback(self._dispatch_concurrent_shell_msg, args[0])
+            return
+        super(BufferedKernelBase, self).schedule_dispatch(dispatch, *args)
 
-            setattr(self, msg_type, MethodType(handler, self))
-            self.shell_handlers[msg_type] = getattr(self, msg_type)
+    def _is_concurrent_shell_msg(self, msg):
+        if not self._shell_busy or self.session is None:
+            return False
+        try:
+            idents, msg_list = self.session.feed_identities(msg, copy=False)
+            header = self.session.deserialize(msg_list, content=False, copy=False)['header']
+        except Exception:
+            return False
+        return header['msg_type'] in self.concurrent_msg_types
 
-        comm_msg_types = ['comm_open', 'comm_msg', 'comm_close']
-        for msg_type in comm_msg_types:
-            self.log.debug('init shell comm message handler: msg_type=%s', msg_type)
+    async def _dispatch_concurrent_shell_msg(self, msg, subshell_id=None):
+        idents, msg_list = self.session.feed_identities(msg, copy=False)
+        try:
+            parent = self.session.deserialize(msg_list, content=True, copy=False)
+        except Exception:
+            self.log.error("Invalid Message", exc_info=True)
+            return
 
-            setattr(self, msg_type, MethodType(handler, self))
-            self.shell_handlers[msg_type] = getattr(self, msg_type)
+        if getattr(self, '_supports_kernel_subshells', False):
+            manager = self.shell_channel_thread.manager
+            stream = manager.get_subshell_to_shell_channel_socket(subshell_id)
+        else:
+            stream = self.shell_stream
+
+        self.log.debug("Received concurrent shell message: %s", parent)
+        try:
+            await self._wait_for_wrapped_kernel()
+            await self._handle_concurrent_shell_msg(stream, idents, parent)
+        except Exception:
+            self.log.error("Exception in concurrent message handler:", exc_info=True)
+
+    async def _handle_concurrent_shell_msg(self, stream, ident, parent):
+        msg_type = parent['msg_type']
+        if msg_type in self.empty_reply_msg_types:
+            reply_type = msg_type.replace('_request', '_reply')
+            self.session.send(stream, reply_type, self._empty_reply_content(parent),
+                              parent, ident)
+            return
+
+        msg = self.kc.session.msg(msg_type, parent['content'])
+        msgid = msg['header']['msg_id']
+        self.log.debug("save concurrent parent_header: %s => %s", msgid, parent['header'])
+        self.parent_headers[msgid] = parent['header']
+
+        # the shell channel of the wrapped kernel is busy, but its control
+        # channel accepts the same requests
+        future = self._send_to_wrapped_kernel('control', msg, reply=True)
+        try:
+            reply_msg = await asyncio.wait_for(future, self.concurrent_reply_timeout / 1000.0)
+        except asyncio.TimeoutError:
+            # e.g. the wrapped kernel serves these requests only on shell
+            self.log.warning('no reply to %s on the control channel in %dms',
+                             msg_type, self.concurrent_reply_timeout)
+            self.reply_futures.pop(msgid, None)
+            self._remove_parent_header(msgid)
+            reply_type = msg_type.replace('_request', '_reply')
+            self.session.send(stream, reply_type, self._empty_reply_content(parent),
+                              parent, ident)
+            return
+
+        self.session.send(stream,
+                          reply_msg['msg_type'],
+                          reply_msg['content'],
+                          parent, ident,
+                          header=reply_msg['header'],
+                          metadata=reply_msg['metadata'],
+                          buffers=reply_msg['buffers'])
+
+    def _empty_reply_content(self, parent):
+        msg_type = parent['msg_type']
+        if msg_type == 'complete_request':
+            cursor_pos = parent['content'].get('cursor_pos')
+            return {'status': 'ok', 'matches': [],
+                    'cursor_start': cursor_pos, 'cursor_end': cursor_pos,
+                    'metadata': {}}
+        if msg_type == 'inspect_request':
+            return {'status': 'ok', 'found': False, 'data': {}, 'metadata': {}}
+        if msg_type == 'comm_info_request':
+            return {'status': 'ok', 'comms': {}}
+        return {'status': 'error', 'ename': 'KernelBusy',
+                'evalue': 'kernel is busy', 'traceback': []}
+
+    def _send_to_wrapped_kernel(self, channel, msg, reply=False):
+        """Send a request to the wrapped kernel.
+
+        With `reply=True`, return a future resolved with the reply message.
+        """
+        future = None
+        if reply:
+            future = asyncio.get_running_loop().create_future()
+            self.reply_futures[msg['header']['msg_id']] = future
+        self.proxy.send(channel, msg)
+        return future
+
+    def _dispatch_reply(self, reply_msg):
+        # outputs sent before the reply reach the frontend before it
+        self._flush_stream_msgs()
+        msg_id = reply_msg['parent_header'].get('msg_id')
+        future = self.reply_futures.pop(msg_id, None)
+        if future is None:
+            self.log.debug('drop reply of unknown request: %s', msg_id)
+            return
+
+        def set_reply():
+            if not future.done():
+                future.set_result(reply_msg)
+        future.get_loop().call_soon_threadsafe(set_reply)
+
+    @contextmanager
+    def _interrupt_wrapped_kernel_on_sigint(self):
+        if threading.current_thread() is not threading.main_thread():
+            yield
+            return
+
+        def handle_sigint(*args):
+            self.log.debug("KeyboardInterrupt")
+            self._interrupt_wrapped_kernel()
+
+        save_sigint = signal.signal(signal.SIGINT, handle_sigint)
+        try:
+            yield
+        finally:
+            signal.signal(signal.SIGINT, save_sigint)
+
+    @contextmanager
+    def _abort_on_sigint(self):
+        # an interrupt before the wrapped kernel is ready aborts the request
+        # instead of raising KeyboardInterrupt in the event loop
+        interrupted = threading.Event()
+        if threading.current_thread() is not threading.main_thread():
+            yield interrupted
+            return
+
+        def handle_sigint(*args):
+            self.log.debug("KeyboardInterrupt while starting the wrapped kernel")
+            interrupted.set()
+
+        save_sigint = signal.signal(signal.SIGINT, handle_sigint)
+        try:
+            yield interrupted
+        finally:
+            signal.signal(signal.SIGINT, save_sigint)
+
+    def _interrupt_wrapped_kernel(self):
+        # propagate SIGINT to wrapped kernel
+        interrupted = self.km.interrupt_kernel()
+        if inspect.isawaitable(interrupted):
+            # called from the signal handler: wake up the event loop
+            asyncio.run_coroutine_threadsafe(interrupted, self._wrapped_kernel_loop)
+        self.keyboard_interrupt = True
+
+        # this timer fire when the ipython kernel didnot interrupt within 5.0 sec.
+        self.timer = Timer(5.0, self.close_files)
+        self.log.debug('>>>>> close files: timer fired')
+        self.timer.start()
 
     def start_ipython_kernel(self):
-        kernel_name = self._get_wrapped_kernel_name()
-        self.km = KernelManager(kernel_name=kernel_name,
-                                client_class='jupyter_client.blocking.BlockingKernelClient')
+        self.km = self._create_kernel_manager(
+            KernelManager, client_class='jupyter_client.blocking.BlockingKernelClient')
         self.log.debug('kernel_manager: %s', str(self.km))
 
-        self.log.info('start wrapped kernel: %s', kernel_name)
+        self.log.info('start wrapped kernel: %s', self.km.kernel_name)
+        start = time.monotonic()
         self.km.start_kernel()
+        launched = time.monotonic()
         self.kc = self.km.client()
         self.log.debug('kernel_client: %s', str(self.kc))
 
@@ -377,19 +863,121 @@ class BufferedKernelBase(Kernel):
         except RuntimeError:
             self.kc.stop_channels()
             self.km.shutdown_kernel()
+            self._remove_runtime_dir()
             raise
 
-        for channel in self.proxy_channles:
-            stream = getattr(self, channel + '_socket')
-            thread = ChannelReaderThread(self, self.kc, stream, self.session, channel)
-            thread.start()
-            self.threads[channel] = thread
+        self.proxy = ChannelProxyThread(self, self.kc, self.session)
+        self.proxy.start()
+        self._log_wrapped_kernel_startup(start, launched)
+
+    async def start_ipython_kernel_async(self):
+        self._wrapped_kernel_loop = asyncio.get_running_loop()
+        self.km = self._create_kernel_manager(AsyncKernelManager)
+        self.log.debug('kernel_manager: %s', str(self.km))
+
+        self.log.info('start wrapped kernel: %s', self.km.kernel_name)
+        start = time.monotonic()
+        await self.km.start_kernel()
+        launched = time.monotonic()
+        self.kc = self.km.client()
+        self.log.debug('kernel_client: %s', str(self.kc))
+
+        # the kernel manager tells whether the wrapped kernel is alive,
+        # so the heartbeat thread is not needed
+        self.log.debug('start_channels')
+        self.kc.start_channels(hb=False)
+
+        try:
+            self.log.debug('wait for ready of wrapped kernel')
+            await self.kc.wait_for_ready(timeout=None)
+        except RuntimeError:
+            self.kc.stop_channels()
+            await self.km.shutdown_kernel()
+            self._remove_runtime_dir()
+            raise
 
+        self.proxy = AsyncChannelProxy(self, self.kc, self.session)
+        self.proxy.start()
+        self._log_wrapped_kernel_startup(start, launched)
+
+    def _log_wrapped_kernel_startup(self, start, launched):
+        now = time.monotonic()
+        self.log.info('startup: wrapped kernel ready in %.3fs (launch %.3fs, wait for ready %.3fs)',
+                      now - start, launched - start, now - launched)
+
+    def _create_kernel_manager(self, kernel_manager_class, **kwargs):
+        if self.wrapped_kernel_transport == 'ipc':
+            self.runtime_dir = self._create_runtime_dir()
+            kwargs['transport'] = 'ipc'
+            kwargs['ip'] = os.path.join(self.runtime_dir, 'kernel')
+            kwargs['connection_file'] = os.path.join(self.runtime_dir, 'kernel.json')
+            self.log.debug('ipc directory of wrapped kernel: %s', self.runtime_dir)
+        km = kernel_manager_class(kernel_name=self._get_wrapped_kernel_name(), **kwargs)
+        self._init_wrapped_kernel_session(km)
+        return km
+
+    def _create_runtime_dir(self):
+        runtime_dir = jupyter_runtime_dir()
+        # the path of a unix domain socket is limited to about 100 bytes
+        if len(runtime_dir) > 64:
+            runtime_dir = tempfile.gettempdir()
+        ensure_dir_exists(runtime_dir, mode=0o700)
+        # mkdtemp creates the directory with mode 0700
+        return tempfile.mkdtemp(prefix='lc_wrapper-', dir=runtime_dir)
+
+    def _remove_runtime_dir(self):
+        if self.runtime_dir is None:
+            return
+        self.log.debug('remove ipc directory of wrapped kernel: %s', self.runtime_dir)
+        shutil.rmtree(self.runtime_dir, ignore_errors=True)
+        self.runtime_dir = None
+
+    def _init_wrapped_kernel_session(self, km):
+        scheme = self.wrapped_kernel_signature_scheme
+        if scheme == 'none':
+            if not self._is_private_connection(km):
+                self.log.warning('unsigned messages need ipc sockets in a private directory; '
+                                 'signing messages to the wrapped kernel with %s',
+                                 km.session.signature_scheme)
+                return
+            km.session.key = b''
+        else:
+            try:
+                km.session.signature_scheme = scheme
+            except TraitError as e:
+                self.log.warning('invalid signature scheme: %s', e)
+                return
+        self.log.info('signature scheme of the wrapped kernel: %s', scheme)
+
+    def _is_private_connection(self, km):
+        if km.transport != 'ipc':
+            return False
+        try:
+            st = os.stat(os.path.dirname(os.path.abspath(km.ip)))
+        except OSError:
+            return False
+        return st.st_uid == os.getuid() and (st.st_mode & 0o077) == 0
+
+    async def _wait_for_wrapped_kernel(self):
+        if self._wrapped_kernel_started is not None:
+            await asyncio.wrap_future(self._wrapped_kernel_started)
+        restarting = self._wrapped_kernel_restarting
+        if restarting is not None:
+            # set on the thread which handles the restart
+            await asyncio.wrap_future(restarting)
+
+    async def _wait_for_log_settings(self):
+        if self._log_settings_ready is not None:
+            await asyncio.wrap_future(self._log_settings_ready)
+
+    def _init_log_settings(self):
+        start = time.monotonic()
         for log_dir in self.log_dirs:
             if self._is_writable_dir(log_dir):
                 self.log_path = log_dir
                 break
         self.log.debug('log output directory: %s', self.log_path)
+        log_dir_found = time.monotonic()
 
         if self._find_default_keyword_pattern_file() is None:
             self.log.info('default keyword pattern file "%s" not found', IPYTHON_DEFAULT_PATTERN_FILE)
@@ -397,11 +985,14 @@ class BufferedKernelBase(Kernel):
                 self._generate_default_keyword_pattern_file()
             except Exception as e:
                 self.log.exception("failed to generate default keyword pattern file: %s", e)
+        pattern_file_found = time.monotonic()
 
-        self.exec_info = None
-
-        self.notebook_path = self.get_notebook_path()
-        self.log.debug('notebook_path: %s', self.notebook_path)
+        self.log.debug('server signature file: %s', self.server_signature_file)
+        now = time.monotonic()
+        self.log.info('startup: log settings ready in %.3fs (log directory %.3fs, '
+                      'keyword pattern file %.3fs, server signature file %.3fs)',
+                      now - start, log_dir_found - start,
+                      pattern_file_found - log_dir_found, now - pattern_file_found)
 
     def _is_writable_dir(self, path):
         temp_dir = None
@@ -425,6 +1016,7 @@ class BufferedKernelBase(Kernel):
             parent_header = self.parent_headers[msg_id]
             self.log.debug("remove parent_header: %s => %s", msg_id, str(parent_header))
             del self.parent_headers[msg_id]
+        self.parent_idents.pop(msg_id, None)
 
     def _hook_request_msg(self, parent):
         msg_type = parent['msg_type']
@@ -475,6 +1067,7 @@ class BufferedKernelBase(Kernel):
             if self.summarize_on:
                 self._start_summarize()
             self._load_env(env)
+            self.log.debug('file cache: %d hits, %d misses', *self._file_cache_stats())
             if not self.log_history_id is None:
                 meme = {'lc_cell_meme': {'current': self.log_history_id}}
                 self.log_buff_append(u'{}\n----\n'.format(json.dumps(meme)))
@@ -506,14 +1099,16 @@ class BufferedKernelBase(Kernel):
 
         return content
 
-    def _post_send_reply_msg(self, parent, reply_msg):
+    async def _post_send_reply_msg(self, parent, reply_msg):
         msg_type = parent['msg_type']
         if msg_type == 'execute_request':
             content = parent['content']
             silent = content['silent']
             stop_on_error = content.get('stop_on_error', True)
             if not silent and reply_msg['content']['status'] == u'error' and stop_on_error:
-                run_sync(self._abort_queues())
+                aborted = self._abort_queues()
+                if inspect.isawaitable(aborted):
+                    await aborted
 
     def _post_wait_for_idle(self, parent, reply_msg):
         if reply_msg is None:
@@ -522,29 +1117,85 @@ class BufferedKernelBase(Kernel):
             self.log.debug('flushing stdout stream')
             self._send_last_stdout_stream_text()
             self.log.debug('flushed stdout stream')
+            self._log_keyword_stats()
 
             self.execute_request_msg_id = None
 
+    def _can_forward_raw_iopub_msg(self, parent_header, msg):
+        """Whether an iopub message can be forwarded without unpacking it.
+
+        `msg['content']` is still the packed content. Messages of the
+        current execution go through `_output_hook`, and messages whose
+        content may refer to the wrapped msg_id need `_replace_msg_id`.
+        """
+        if self.execute_request_msg_id == parent_header['msg_id']:
+            return False
+        if not msg['header'].get('version', '').startswith('5.'):
+            return False
+        if msg['msg_type'] not in self.msg_id_content_fields:
+            return True
+        wrapped_msg_id = msg['parent_header']['msg_id']
+        return wrapped_msg_id.encode('utf-8') not in msg['content']
+
+    def _send_iopub_msg(self, parent_header, msg, content):
+        coalescer = self.stream_coalescer
+        if coalescer is not None:
+            if msg['msg_type'] == 'stream' and not self.summarize_on and \
+               self.execute_request_msg_id == parent_header['msg_id']:
+                coalescer.add(parent_header, msg, content)
+                return
+            coalescer.flush()
+        self._send_wrapped_iopub_msg(parent_header, msg, content)
+
+    def _send_iopub_msg_of_no_request(self, msg, content):
+        """Send a message of an unknown or finished request with an empty parent header."""
+        self._flush_coalesced_stream_msgs()
+        self._send_wrapped_iopub_msg({}, msg, content)
+
+    def _send_wrapped_iopub_msg(self, parent_header, msg, content):
+        msg_type = msg['msg_type']
+        self.session.send(self.iopub_socket,
+                          msg_type,
+                          content,
+                          parent=parent_header,
+                          ident=self._topic(msg_type),
+                          header=msg['header'],
+                          metadata=msg['metadata'],
+                          buffers=msg['buffers'])
+
+    def _flush_stream_msgs(self):
+        self._flush_masked_stream_text()
+        self._flush_coalesced_stream_msgs()
+
+    def _flush_coalesced_stream_msgs(self):
+        if self.stream_coalescer is not None:
+            self.stream_coalescer.flush()
+
     def _hook_iopub_msg(self, parent_header, msg):
         msg_id = parent_header['msg_id']
 
         content = msg['content']
         # replace msg_id in the content
-        self._replace_msg_id(msg_id, msg['parent_header']['msg_id'], content)
+        self._replace_msg_id(msg_id, msg['parent_header']['msg_id'],
+                             msg['msg_type'], content)
 
         if self.execute_request_msg_id == msg_id:
             return self._output_hook(msg)
 
         return content
 
-    def _replace_msg_id(self, msg_id, wrapped_msg_id, content):
-        for k, v in content.items():
-            if isinstance(v, dict):
-                self._replace_msg_id(msg_id, wrapped_msg_id, v)
-            elif v == wrapped_msg_id:
-                content[k] = msg_id
-                self.log.debug('replace msg_id in content: %s => %s',
-                               wrapped_msg_id, msg_id)
+    def _replace_msg_id(self, msg_id, wrapped_msg_id, msg_type, content):
+        for path in self.msg_id_content_fields.get(msg_type, []):
+            fields = content
+            for key in path[:-1]:
+                fields = fields.get(key)
+                if not isinstance(fields, dict):
+                    break
+            else:
+                if fields.get(path[-1]) == wrapped_msg_id:
+                    fields[path[-1]] = msg_id
+                    self.log.debug('replace msg_id in content: %s => %s',
+                                   wrapped_msg_id, msg_id)
 
     def _write_log(self, msg):
         if not msg is None:
@@ -554,7 +1205,8 @@ class BufferedKernelBase(Kernel):
     def open_log_file(self, path):
         self.log.debug('>>>>> open_log_file')
 
-        now = datetime.now(dateutil.tz.tzlocal())
+        from dateutil.tz import tzlocal
+        now = datetime.now(tzlocal())
         path = os.path.join(path, now.strftime("%Y%m%d"))
         if not os.path.exists(path):
             os.makedirs(path)
@@ -596,37 +1248,65 @@ class BufferedKernelBase(Kernel):
                       self.log_history_id, os.getuid(), os.getgid(), self.get_server_signature())
 
     def get_server_signature(self):
-        if os.path.exists(self.server_signature_file):
-            with io.open(self.server_signature_file, 'r') as f:
-                return f.read()
-        else:
-            return None
+        return self._server_signature_cache.get(self.server_signature_file,
+                                                self._read_server_signature_file)
+
+    def _read_server_signature_file(self, path):
+        with io.open(path, 'r') as f:
+            return f.read()
+
+    def _file_cache_stats(self):
+        caches = [self._config_cache, self._keyword_pattern_cache, self._server_signature_cache,
+                  self._masking_file_cache]
+        return sum(c.hits for c in caches), sum(c.misses for c in caches)
+
+    def _expect_idle(self, msg_id):
+        """Return a future resolved when the wrapped kernel becomes idle
+        after processing the request `msg_id`."""
+        future = asyncio.get_running_loop().create_future()
+        self.idle_futures[msg_id] = future
+        return future
+
+    def _dispatch_idle(self, msg_id):
+        future = self.idle_futures.pop(msg_id, None)
+        if future is None:
+            return
+
+        def set_idle():
+            if not future.done():
+                future.set_result(None)
+        future.get_loop().call_soon_threadsafe(set_idle)
 
-    def _wait_for_idle(self, msg_id):
+    async def _wait_for_idle(self, msg_id, future):
         self.log.debug('waiting for idle: msg_id=%s', msg_id)
-        while True:
-            self.idle_event.wait()
-            if self.idle_parent_header['msg_id'] != msg_id:
-                self.log.warn('unexpected idle message received: expected msg_id=%s, received msg_id=%s',
-                              msg_id, self.idle_parent_header['msg_id'])
-                continue
-            self.log.debug('idle: msg_id=%s', msg_id)
-            return
+        start = time.monotonic()
+        await future
+        elapsed = time.monotonic() - start
+        self.idle_waits += 1
+        self.idle_wait_time += elapsed
+        self.log.debug('idle: msg_id=%s, waited %.3fs (%d waits, %.3fs in total)',
+                       msg_id, elapsed, self.idle_waits, self.idle_wait_time)
 
     def get_notebook_path(self):
         return getcwd()
 
-    def _find_config_file(self):
+    def _get_config(self):
+        config = {}
+        # the first config file found, with a single stat of each path
         for path in self.configfile_paths:
-            if os.path.exists(path):
-                return path
-        return None
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            config = dict(self._config_cache.get(path, self._read_config_file, st=st))
+            break
+        environ = os.environ
+        for k in CONFIG_KEYS:
+            if k in environ:
+                config[k] = environ[k]
+        return config
 
-    def _get_config(self):
-        env = os.environ
-        config_path = self._find_config_file()
-        if config_path is None:
-            return env
+    def _read_config_file(self, config_path):
         line_pattern = re.compile(r'(\S+)=(".*?"|\S+)')
         config = {}
         with io.open(config_path, 'r', encoding='utf-8') as f:
@@ -639,11 +1319,11 @@ class BufferedKernelBase(Kernel):
                     config[m.group(1)] = m.group(2)
                 else:
                     self.log.warning('Unexpected line: {} at {}'.format(l, config_path))
-        for k, v in env.items():
-            config[k] = v
         return config
 
     def send_clear_content_msg(self):
+        # the text held back by the maskers follows the current message
+        self._flush_coalesced_stream_msgs()
         clear_content = {'wait': True}
         self.session.send(self.iopub_socket, 'clear_output', clear_content, self._parent_header,
             ident=None, buffers=None, track=False, header=None, metadata=None)
@@ -667,10 +1347,23 @@ class BufferedKernelBase(Kernel):
 
         self.log_history_data = self._read_log_history_file()
 
+        self._flush_stream_msgs()
         if MASKING_KEY in env:
             self.masking_pattern = re.compile(env.get(MASKING_KEY))
+            self._check_superlinear(MASKING_KEY, self.masking_pattern)
         else:
             self.masking_pattern = None
+        self.masking_literals = None
+        if MASKING_FILE_KEY in env:
+            self.masking_literals = self._load_masking_file(env.get(MASKING_FILE_KEY))
+        self.stream_coalescer = self._create_stream_coalescer(env.get(COALESCE_KEY, ''))
+
+        self.output_rate_meter = None
+        if not self.summarize_on:
+            self.output_rate_meter = self._create_output_rate_meter(env.get(AUTO_SUMMARIZE_KEY, ''))
+            if self.output_rate_meter is not None:
+                # keep the first and last lines in case the output is summarized
+                self._start_summarize()
 
         if LOG_MASKING_KEY in env:
             self.log_mask = env.get(LOG_MASKING_KEY)
@@ -690,23 +1383,110 @@ class BufferedKernelBase(Kernel):
             if file_path is None:
                 self.keyword_buff_append(u'error : {} Not found'.format(IPYTHON_DEFAULT_PATTERN_FILE))
                 self.log.warning('lc_wrapper_regex: %s Not found', IPYTHON_DEFAULT_PATTERN_FILE)
-            elif os.path.exists(file_path):
+            else:
                 try:
-                    patterns = self._read_keyword_pattern_file(file_path)
-                    for ptxt in patterns:
-                        self.repatter.append(re.compile(ptxt))
+                    repatter = self._keyword_pattern_cache.get(
+                        file_path, self._compile_keyword_pattern_file)
                 except Exception as e:
+                    repatter = []
                     self.keyword_buff_append(u'error : ' + str(e))
                     self.log.exception("lc_wrapper_regex: %s", e)
-            else:
-                self.keyword_buff_append(u'error : {} Not found'.format(file_path))
-                self.log.warning('lc_wrapper_regex: %s Not found', file_path)
+                if repatter is None:
+                    self.keyword_buff_append(u'error : {} Not found'.format(file_path))
+                    self.log.warning('lc_wrapper_regex: %s Not found', file_path)
+                else:
+                    self.repatter.extend(repatter)
         else:
             try:
                 self.repatter.append(re.compile(text))
             except Exception as e:
                 self.keyword_buff_append(u'error : ' + str(e))
                 self.log.exception("lc_wrapper_regex: %s", e)
+        for p in self.repatter:
+            self._check_superlinear(IGNORE_SUMMARIZE_KEY, p)
+
+        self.keyword_guard = self._create_regex_guard(env.get(REGEX_GUARD_KEY, ''))
+        matcher = self._get_keyword_matcher()
+        # the lines over budget are counted for each cell
+        self._keyword_lines_over_budget = matcher.lines_over_budget
+
+        if self.output_processes > 0:
+            if self.output_pool is None:
+                # multiprocessing is only loaded in this mode
+                from .offload import OutputProcessPool
+                self.output_pool = OutputProcessPool(self.output_processes,
+                                                     self.output_process_min_chars)
+            self.output_pool.configure(self.masking_pattern, self.masking_literals, matcher)
+
+    def _check_superlinear(self, key, pattern):
+        # warn once for each pattern
+        checked = (key, pattern.pattern, pattern.flags)
+        if checked in self._superlinear_reasons:
+            return
+        reason = superlinear_reason(pattern)
+        self._superlinear_reasons[checked] = reason
+        if reason is not None:
+            self.log.warning('%s: %r may take super-linear time: %s', key, pattern.pattern, reason)
+
+    def _create_regex_guard(self, text):
+        text = text.strip()
+        if len(text) == 0 or text.lower() == 'off':
+            return None
+        guard_pattern = re.compile(r'^([0-9]*):([0-9]*)$')
+        guard_params = guard_pattern.match(text)
+        if guard_params is None:
+            self.log.warning('lc_wrapper_regex_guard: unexpected value: %s', text)
+            return None
+        max_line_length = None
+        line_budget = None
+        if len(guard_params.group(1)) != 0:
+            max_line_length = int(guard_params.group(1))
+        if len(guard_params.group(2)) != 0:
+            line_budget = int(guard_params.group(2)) / 1000.0
+        if max_line_length is None and line_budget is None:
+            return None
+        self.log.debug('regex guard: %s characters, %s seconds per line', max_line_length, line_budget)
+        return max_line_length, line_budget
+
+    def _create_stream_coalescer(self, text):
+        text = text.strip()
+        if len(text) == 0 or text.lower() == 'off':
+            return None
+        coalesce_pattern = re.compile(r'^([0-9]*):([0-9]*)$')
+        coalesce_params = coalesce_pattern.match(text)
+        if coalesce_params is None:
+            self.log.warning('lc_wrapper_coalesce: unexpected value: %s', text)
+            return None
+        interval = 100
+        max_bytes = 65536
+        if len(coalesce_params.group(1)) != 0:
+            interval = int(coalesce_params.group(1))
+        if len(coalesce_params.group(2)) != 0:
+            max_bytes = int(coalesce_params.group(2))
+        self.log.debug('coalesce stream messages: %dms, %d bytes', interval, max_bytes)
+        return StreamCoalescer(self._send_wrapped_iopub_msg,
+                               interval=interval / 1000.0,
+                               max_bytes=max_bytes)
+
+    def _create_output_rate_meter(self, text):
+        text = text.strip()
+        if len(text) == 0 or text.lower() == 'off':
+            return None
+        rate_pattern = re.compile(r'^([0-9]*):([0-9]*)$')
+        rate_params = rate_pattern.match(text)
+        if rate_params is None:
+            self.log.warning('lc_wrapper_auto_summarize: unexpected value: %s', text)
+            return None
+        max_lines = None
+        max_bytes = None
+        if len(rate_params.group(1)) != 0:
+            max_lines = int(rate_params.group(1))
+        if len(rate_params.group(2)) != 0:
+            max_bytes = int(rate_params.group(2))
+        if max_lines is None and max_bytes is None:
+            return None
+        self.log.debug('auto summarize: %s lines/s, %s bytes/s', max_lines, max_bytes)
+        return OutputRateMeter(max_lines=max_lines, max_bytes=max_bytes)
 
     def _find_default_keyword_pattern_file(self):
         for path in self.keyword_pattern_file_paths:
@@ -714,6 +1494,28 @@ class BufferedKernelBase(Kernel):
                 return path
         return None
 
+    def _load_masking_file(self, path):
+        path = os.path.join(self.notebook_path, os.path.expanduser(path))
+        try:
+            literals = self._masking_file_cache.get(path, self._read_masking_file)
+        except Exception as e:
+            self.log.warning('lc_wrapper_masking_file: %s: %s', path, e)
+            return None
+        if literals is None:
+            self.log.warning('lc_wrapper_masking_file: %s Not found', path)
+        return literals
+
+    def _read_masking_file(self, path):
+        # one secret per line, masked wherever it appears
+        with io.open(path, 'r', encoding='utf-8') as f:
+            secrets = [line.rstrip(u'\r\n') for line in f]
+        literals = LiteralMatcher(secrets)
+        self.log.debug('lc_wrapper_masking_file: %d secrets in %s', len(literals.words), path)
+        return literals
+
+    def _compile_keyword_pattern_file(self, filename):
+        return [re.compile(ptxt) for ptxt in self._read_keyword_pattern_file(filename)]
+
     def _read_keyword_pattern_file(self, filename):
         with open(filename, 'r') as file:
             patterns = file.readlines()
@@ -791,26 +1593,70 @@ class BufferedKernelBase(Kernel):
         return stream_text
 
     def highlight_keywords(self, text):
-        matched = [p.search(text) for p in self.repatter]
-        matched = [m for m in matched if m is not None]
-        if len(matched) == 0:
-            return None
-        remain = text
-        result = None
-        while len(matched) > 0:
-            left = min([m.start() for m in matched])
-            if result is None:
-                result = remain[:left]
-            else:
-                result += remain[:left]
-            keywords = [m.group() for m in matched if m.start() == left]
-            keyword = sorted(keywords, key=lambda s: len(s))[-1]
-            result += u'\033[0;31m{}\033[0m'.format(keyword)
-            remain = remain[left + len(keyword):]
-
-            matched = [p.search(remain) for p in self.repatter]
-            matched = [m for m in matched if m is not None]
-        return result + remain
+        matcher = self._get_keyword_matcher()
+        skipped = len(matcher.skipped_patterns)
+        highlighted = matcher.highlight(text)
+        self._warn_skipped_patterns(matcher, skipped)
+        return highlighted
+
+    def highlight_keyword_lines(self, text, lines):
+        matcher = self._get_keyword_matcher()
+        skipped = len(matcher.skipped_patterns)
+        pool = self.output_pool
+        pieces = None
+        if pool is not None and pool.keyword_matcher is matcher:
+            pieces = pool.split(text)
+        highlighted = None
+        if pieces is not None:
+            try:
+                highlighted = pool.highlight_lines(pieces)
+            except concurrent.futures.BrokenExecutor as e:
+                self._shutdown_broken_output_pool(e)
+        if highlighted is None:
+            highlighted = matcher.highlight_lines(text, lines)
+        self._warn_skipped_patterns(matcher, skipped)
+        return highlighted
+
+    def _get_keyword_matcher(self):
+        matcher = self.keyword_matcher
+        guard = self.keyword_guard or (None, None)
+        if matcher is None or matcher.patterns != self.repatter or \
+                (matcher.max_line_length, matcher.line_budget) != guard:
+            matcher = self.keyword_matcher = KeywordMatcher(self.repatter, *guard)
+        return matcher
+
+    def _warn_skipped_patterns(self, matcher, skipped):
+        for p in matcher.skipped_patterns[skipped:]:
+            self.log.warning('lc_wrapper_regex_guard: %r took more than %.0fms on a line, '
+                             'no longer searched', p, matcher.line_budget * 1000)
+
+    def _keyword_guard_footer(self):
+        matcher = self.keyword_matcher
+        if matcher is None:
+            return u''
+        lines = matcher.lines_over_budget - self._keyword_lines_over_budget
+        if lines == 0 and len(matcher.skipped_patterns) == 0:
+            return u''
+        footer = u'lc_wrapper_regex_guard: {} lines over budget, not highlighted\n'.format(lines)
+        for p in matcher.skipped_patterns:
+            footer += u'lc_wrapper_regex_guard: {} skipped, too slow\n'.format(p)
+        return footer
+
+    def _log_keyword_stats(self):
+        matcher = self.keyword_matcher
+        if matcher is None or matcher.lines_checked == 0:
+            return
+        self.log.debug('keyword prefilter: %d of %d lines rejected (%.1f%%), %d matched',
+                       matcher.lines_rejected, matcher.lines_checked,
+                       100.0 * matcher.lines_rejected / matcher.lines_checked,
+                       matcher.lines_matched)
+        over_budget = matcher.lines_over_budget - self._keyword_lines_over_budget
+        if over_budget > 0:
+            self.log.warning('lc_wrapper_regex_guard: %d lines over budget, not highlighted',
+                             over_budget)
+        for p in matcher.unfiltered_patterns:
+            self.log.debug('keyword prefilter: no literal required by %r, always searched',
+                           p.pattern)
 
     def _read_log_history_file(self):
         if self.log_history_file_path is not None and \
@@ -884,6 +1730,7 @@ class BufferedKernelBase(Kernel):
         result_file = os.path.join(log_dir,
                                    u'{}-{}.pkl'.format(log_name_body,
                                                        len(self.result_files)))
+        import pickle
         with open(result_file, 'wb') as f:
             pickle.dump(result, f)
         self.result_files.append(result_file)
@@ -906,30 +1753,22 @@ class BufferedKernelBase(Kernel):
             if 'ExecutionResult' in content['text']:
                 return content
             else:
-                masked_text = self._mask_lines(content['text'])
-                if self.log_mask == 'on':
-                    self.log_buff_append(masked_text)
-                else :
-                    self.log_buff_append(content['text'])
-                self._log_buff_flush()
-
-                content['text'] = masked_text
-                content_text_list = content['text'].splitlines(False)    # with LF
-                # save the stderr messages
-                if content['name'] == 'stderr':
-                    self.keyword_buff_append(content_text_list)
-                # save the sentences the keyword matched
-                elif not self.repatter is None and len(self.repatter) > 0:
-                    for text in content_text_list:
-                        matched = self.highlight_keywords(text)
-                        if matched is not None:
-                            self.keyword_buff_append(matched, highlight=False)
-
-                if self.summarize_on:
-                    return self._summarize_stream_output(msg, content, content_text_list)
-
-                return content
-        elif msg_type in ('display_data', 'execute_result'):
+                text = content['text']
+                masker = self._get_stream_masker(msg)
+                if masker is None:
+                    masked_text = self._mask_lines(text)
+                else:
+                    masked_text = self._feed_stream_masker(masker, text)
+                    if masker.held == 0:
+                        self.masked_stream_deadline = None
+                    elif self.masked_stream_deadline is None:
+                        self.masked_stream_deadline = \
+                            time.monotonic() + self.masking_carry_over_time / 1000.0
+                return self._process_stream_text(msg, content, masked_text,
+                                                 masked_text if self.log_mask == 'on' else text)
+        # the stream text held back is output before
+        self._flush_masked_stream_text()
+        if msg_type in ('display_data', 'execute_result'):
             execute_result = content.copy()
             execute_result['execution_count'] = self.execution_count
             self._store_result({'msg_type': msg_type, 'content': execute_result})
@@ -952,6 +1791,122 @@ class BufferedKernelBase(Kernel):
 
         return content
 
+    def _process_stream_text(self, msg, content, text, log_text):
+        """Log, scan and summarize the masked `text` of a stream message.
+
+        Return the content to send, or None if `text` is empty.
+        """
+        self.log_buff_append(log_text)
+        self._log_buff_flush()
+        if len(text) == 0:
+            return None
+
+        content['text'] = text
+        content_text_list = content['text'].splitlines(False)    # with LF
+        # save the stderr messages
+        if content['name'] == 'stderr':
+            self.keyword_buff_append(content_text_list)
+        # save the sentences the keyword matched
+        elif not self.repatter is None and len(self.repatter) > 0:
+            matched = self.highlight_keyword_lines(content['text'], content_text_list)
+            if len(matched) > 0:
+                self.keyword_buff_append(matched, highlight=False)
+
+        if self.output_rate_meter is not None and not self.summarize_on:
+            self._measure_output_rate(content['text'], content_text_list)
+
+        if self.summarize_on:
+            return self._summarize_stream_output(msg, content, content_text_list)
+
+        if self.output_rate_meter is not None:
+            self._store_unsummarized_lines(content_text_list)
+
+        return content
+
+    def _feed_stream_masker(self, masker, text):
+        """Return the text of `masker.feed(text)`, with the complete lines of a
+        large chunk masked by the output pool."""
+        pool = self.output_pool
+        if pool is None or not masker.line_independent or \
+                pool.masking_pattern is not masker.pattern or \
+                pool.masking_literals is not masker.literals:
+            return masker.feed(text)
+        first = text.find(u'\n') + 1
+        last = text.rfind(u'\n') + 1
+        pieces = pool.split(text[first:last])
+        if pieces is None:
+            return masker.feed(text)
+        try:
+            masked = pool.mask(pieces)
+        except concurrent.futures.BrokenExecutor as e:
+            self._shutdown_broken_output_pool(e)
+            return masker.feed(text)
+        # the first line completes the text held back by the masker
+        return masker.feed(text[:first]) + masked + masker.feed(text[last:])
+
+    def _shutdown_broken_output_pool(self, e):
+        # e.g. a worker killed when out of memory; a new pool is started by
+        # the next execution
+        self.log.warning('output processes: %s, processing the output in the kernel', e)
+        self.output_pool.shutdown()
+        self.output_pool = None
+
+    def _get_stream_masker(self, msg):
+        """Return the masker of the stream of `msg`, or None without anything to mask.
+
+        The text held back by the maskers of the other streams is output first.
+        """
+        pattern = getattr(self, 'masking_pattern', None)
+        literals = getattr(self, 'masking_literals', None)
+        if pattern is None and literals is None:
+            return None
+        name = msg['content']['name']
+        self._flush_masked_stream_text(keep=name)
+        held = self.stream_maskers.get(name)
+        masker = StreamMasker(pattern, self.masking_carry_over, literals=literals) \
+            if held is None else held[0]
+        self.stream_maskers[name] = (masker, msg)
+        return masker
+
+    def _flush_expired_masked_stream_text(self):
+        deadline = self.masked_stream_deadline
+        if deadline is not None and time.monotonic() >= deadline:
+            self._flush_masked_stream_text()
+
+    def _flush_masked_stream_text(self, keep=None):
+        """Output the text held back by the maskers, except by the one of stream `keep`."""
+        if keep not in self.stream_maskers:
+            self.masked_stream_deadline = None
+        for name in [name for name in self.stream_maskers if name != keep]:
+            masker, msg = self.stream_maskers.pop(name)
+            text = masker.flush()
+            content = self._process_stream_text(msg, dict(msg['content']), text,
+                                                text if self.log_mask == 'on' else u'')
+            if content is None:
+                continue
+            parent_header = self.parent_headers.get(msg['parent_header']['msg_id'])
+            if parent_header is None:
+                self._send_iopub_msg_of_no_request(msg, content)
+                continue
+            self._send_iopub_msg(parent_header, msg, content)
+
+    def _measure_output_rate(self, text, lines):
+        meter = self.output_rate_meter
+        if not meter.add(len(lines), len(text.encode('utf-8'))):
+            return
+        self.log.info('lc_wrapper: output rate exceeded (%d lines, %d bytes in %.1fs), '
+                      'switched to summarizing mode after %d lines',
+                      meter.lines, meter.bytes, meter.window, meter.total_lines)
+        self.summarize_on = True
+        # the lines sent so far count as the head of the output
+        self.count = max(self.count, self.summarize_start_lines)
+
+    def _store_unsummarized_lines(self, lines):
+        if len(self.summarize_header_buff) < self.summarize_header_lines:
+            self.summarize_header_buff.extend(lines)
+        self._store_last_lines(lines)
+        self.count += len(lines)
+
     def _summarize_stream_output(self, msg, content, lines):
         # save the first few lines
         if len(self.summarize_header_buff) < self.summarize_header_lines:
@@ -979,6 +1934,7 @@ class BufferedKernelBase(Kernel):
 
     def _send_last_stdout_stream_text(self):
         self.log.debug('_flush_stdout_stream')
+        self._flush_stream_msgs()
         self.close_files()
 
         if self.summarize_on:
@@ -999,11 +1955,15 @@ class BufferedKernelBase(Kernel):
             stream_text += self.display_keyword_buff()
             stream_text += u'...\n'
             stream_text += u'{}'.format('\n'.join(self.summarize_last_buff[-self.summarize_footer_lines:]))
+        guard_footer = self._keyword_guard_footer()
+        if len(guard_footer) > 0:
+            stream_text += u'\n----\n' + guard_footer
 
         stream_content = {'name': 'stdout', 'text': stream_text}
         self.send_response(self.iopub_socket, 'stream', stream_content)
 
         # Send exeuction result again because last result can be cleared
+        import pickle
         for resultf in self.result_files:
             with open(resultf, 'rb') as f:
                 result = pickle.load(f)
@@ -1018,17 +1978,11 @@ class BufferedKernelBase(Kernel):
                                   metadata=None)
 
     def _mask_lines(self, string):
-        if not hasattr(self, 'masking_pattern'):
+        pattern = getattr(self, 'masking_pattern', None)
+        literals = getattr(self, 'masking_literals', None)
+        if pattern is None and literals is None:
             return string
-        elif self.masking_pattern is None:
-            return string
-        else:
-            pattern = self.masking_pattern
-
-            def asterisks_repl(match):
-                return len(match[0]) * '*'
-
-            return re.sub(pattern, asterisks_repl, string)
+        return mask_text(string, pattern, literals)
 
     def _get_cell_id(self, parent):
         # Try new metadata-based approach first
@@ -1089,35 +2043,133 @@ class BufferedKernelBase(Kernel):
             self.log.debug('close fluent logger sender')
             self.sender.close()
 
+        if self.output_pool is not None:
+            self.output_pool.shutdown()
+            self.output_pool = None
+
+        if self.async_mode:
+            return self._do_shutdown_async(restart)
+
+        if self._wrapped_kernel_started is not None:
+            # shutdown while the wrapped kernel is still starting
+            concurrent.futures.wait([self._wrapped_kernel_started])
+
         self.log.info('stopping wrapped kernel')
         if hasattr(self, "km"):
             self.km.shutdown_kernel(restart=restart)
+        self._remove_runtime_dir()
 
-        for channel, thread in self.threads.items():
-            self.log.info('stopping %s ChannelReaderThread', channel)
-            thread.stop()
+        if self.proxy is not None:
+            self.log.info('stopping ChannelProxyThread')
+            self.proxy.stop()
+            self.proxy = None
 
         return {'status': 'ok', 'restart': restart}
 
+    async def shutdown_request(self, stream, ident, parent):
+        content = parent['content']
+        if not (content.get('restart') and content.get(IN_PLACE_RESTART_KEY)):
+            await super(BufferedKernelBase, self).shutdown_request(stream, ident, parent)
+            return
+        reply_content = await self.restart_wrapped_kernel()
+        self.session.send(stream, 'shutdown_reply', reply_content, parent, ident=ident)
+
+    async def restart_wrapped_kernel(self):
+        """Restart the wrapped kernel, keeping this kernel and its settings.
+
+        Requests which wait for the wrapped kernel are answered as aborted,
+        and the execution count starts over as with a new kernel.
+        """
+        await self._wait_for_wrapped_kernel()
+        self.log.info('restarting wrapped kernel')
+        start = time.monotonic()
+        restarting = self._wrapped_kernel_restarting = concurrent.futures.Future()
+        try:
+            if self.async_mode:
+                future = asyncio.run_coroutine_threadsafe(
+                    self._restart_wrapped_kernel_async(), self._wrapped_kernel_loop)
+                await asyncio.wrap_future(future)
+            else:
+                # as at startup, the blocking client waits in another thread
+                executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix='lc_wrapper-restart')
+                try:
+                    await asyncio.wrap_future(executor.submit(self._restart_wrapped_kernel))
+                finally:
+                    executor.shutdown(wait=False)
+            self.execution_count = 0
+        except Exception:
+            self.log.exception('failed to restart wrapped kernel')
+            return {'status': 'error', 'restart': True}
+        finally:
+            self._wrapped_kernel_restarting = None
+            restarting.set_result(None)
+        self.log.info('restarted wrapped kernel: ready in %.3fs', time.monotonic() - start)
+        return {'status': 'ok', 'restart': True, IN_PLACE_RESTART_KEY: True}
+
+    def _restart_wrapped_kernel(self):
+        # no stream message arrives while the held ones are flushed
+        self.proxy.stop()
+        self._flush_stream_msgs()
+        self.kc.stop_channels()
+        self._abort_pending_requests()
+
+        self.km.restart_kernel()
+        self.kc = self.km.client()
+        self.kc.start_channels()
+        self.kc.wait_for_ready(timeout=None)
 
-class LCWrapperKernelManager(IOLoopKernelManager):
-    """Kernel manager for LC_wrapper kernel"""
-
-    def shutdown_kernel(self, now=False, restart=False):
-        # Stop monitoring for restarting while we shutdown.
-        self.stop_restarter()
+        self.proxy = ChannelProxyThread(self, self.kc, self.session)
+        self.proxy.start()
 
-        self.log.debug("Interrupting the wrapper kernel and its subprocesses")
-        self.interrupt_kernel()
-        time.sleep(5.0)
+    async def _restart_wrapped_kernel_async(self):
+        # no stream message arrives while the held ones are flushed
+        self.proxy.stop()
+        self._flush_stream_msgs()
+        self.kc.stop_channels()
+        self._abort_pending_requests()
 
-        if now:
-            self._kill_kernel()
-        else:
-            self.request_shutdown(restart=restart)
-            # Don't send any additional kernel kill messages immediately, to give
-            # the kernel a chance to properly execute shutdown actions. Wait for at
-            # most 1s, checking every 0.1s.
-            self.finish_shutdown()
+        await self.km.restart_kernel()
+        self.kc = self.km.client()
+        self.kc.start_channels(hb=False)
+        await self.kc.wait_for_ready(timeout=None)
+
+        self.proxy = AsyncChannelProxy(self, self.kc, self.session)
+        self.proxy.start()
+
+    def _abort_pending_requests(self):
+        # the restarted wrapped kernel never answers the requests sent before
+        for msg_id in list(self.reply_futures):
+            parent_header = self.parent_headers.get(msg_id, {})
+            reply_type = parent_header.get('msg_type', '').replace('_request', '_reply')
+            self.log.info('abort %s: msg_id=%s', reply_type, msg_id)
+            reply_msg = self.kc.session.msg(reply_type, {'status': 'aborted'},
+                                            parent={'msg_id': msg_id})
+            reply_msg['buffers'] = []
+            self._dispatch_reply(reply_msg)
+        for msg_id in list(self.idle_futures):
+            self._dispatch_idle(msg_id)
+            self._remove_parent_header(msg_id)
+
+    async def _do_shutdown_async(self, restart):
+        if self._wrapped_kernel_started is not None:
+            await asyncio.wait([asyncio.wrap_future(self._wrapped_kernel_started)])
+        if hasattr(self, "km"):
+            # shutdown_request may be handled on the loop of the control
+            # thread, but the wrapped kernel belongs to the main loop
+            future = asyncio.run_coroutine_threadsafe(
+                self._shutdown_wrapped_kernel_async(restart),
+                self._wrapped_kernel_loop)
+            await asyncio.wrap_future(future)
+        return {'status': 'ok', 'restart': restart}
 
-        self.cleanup_resources(restart=restart)
+    async def _shutdown_wrapped_kernel_async(self, restart):
+        self.log.info('stopping wrapped kernel')
+        await self.km.shutdown_kernel(restart=restart)
+        self._remove_runtime_dir()
+
+        if self.proxy is not None:
+            self.log.info('stopping AsyncChannelProxy')
+            self.proxy.stop()
+            self.proxy = None
+        self.kc.stop_channels()
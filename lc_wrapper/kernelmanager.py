@@ -0,0 +1,205 @@
+import asyncio
+import threading
+import time
+
+import zmq
+from jupyter_client.ioloop import IOLoopKernelManager
+from jupyter_client.manager import KernelManager
+from jupyter_client.session import Session
+from traitlets import Bool, Float
+
+from .messages import IN_PLACE_RESTART_KEY
+
+# iopub topics are `kernel.<ident>.<msg_type>`
+KERNEL_TOPIC_PREFIX = b'kernel.'
+STATUS_TOPIC_SUFFIX = b'.status'
+
+
+class ExecutionStateWatcher(object):
+    """Follow whether a kernel runs an execute_request from its status messages.
+
+    The iopub socket subscribes to the kernel topics, and then only to the
+    status topic of the kernel once its first status message is seen, so
+    that the kernel stops sending other messages to the watcher. Messages
+    are told apart by their topic frame: only status messages are
+    deserialized.
+    """
+
+    # kernel ids running an execute_request, shared by all the watchers
+    executing_kernel_ids = set()
+
+    def __init__(self, km):
+        self.kernel_id = km.kernel_id
+        self.log = km.log
+        self.status_msg_count = 0
+        # set while no execute_request is running
+        self.idle = threading.Event()
+        self.idle.set()
+        self._idle_waiters = []
+        self._session = Session(config=km.session.config, key=km.session.key)
+        self._topic = None
+
+        self.stream = km.connect_iopub()
+        self.stream.socket.setsockopt(zmq.UNSUBSCRIBE, b'')
+        self.stream.socket.setsockopt(zmq.SUBSCRIBE, KERNEL_TOPIC_PREFIX)
+        self.stream.on_recv(self._record_state)
+
+    @classmethod
+    def executing_kernel_count(cls):
+        return len(cls.executing_kernel_ids)
+
+    @property
+    def executing(self):
+        return not self.idle.is_set()
+
+    def _record_state(self, msg_list):
+        topic = msg_list[0]
+        if not topic.endswith(STATUS_TOPIC_SUFFIX):
+            return
+        if self._topic is None:
+            self._topic = topic
+            self.stream.socket.setsockopt(zmq.SUBSCRIBE, topic)
+            self.stream.socket.setsockopt(zmq.UNSUBSCRIBE, KERNEL_TOPIC_PREFIX)
+
+        idents, fed_msg_list = self._session.feed_identities(msg_list)
+        msg = self._session.deserialize(fed_msg_list)
+        if msg['header']['msg_type'] != 'status':
+            # e.g. iopub_welcome for the new subscription
+            return
+        self.status_msg_count += 1
+        execution_state = msg['content']['execution_state']
+        self.log.debug("kernel_state : status (%s)", execution_state)
+        parent_msg_type = msg['parent_header'].get('msg_type', '')
+        parent_msg_id = msg['parent_header'].get('msg_id', '')
+        if parent_msg_type != 'execute_request':
+            return
+        if execution_state == 'busy':
+            self.log.debug("start execution: msg_id=%s", parent_msg_id)
+            self.idle.clear()
+            self.executing_kernel_ids.add(self.kernel_id)
+        elif execution_state == 'idle':
+            self.log.debug("end execution: msg_id=%s", parent_msg_id)
+            self._set_idle()
+
+    def _set_idle(self):
+        self.idle.set()
+        self.executing_kernel_ids.discard(self.kernel_id)
+        waiters, self._idle_waiters = self._idle_waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def wait_for_idle(self, timeout):
+        """Wait until the running execution ends; return False on timeout."""
+        if self.idle.is_set():
+            return True
+        waiter = asyncio.get_running_loop().create_future()
+        self._idle_waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def wait_for_idle_blocking(self, timeout):
+        """Wait until the running execution ends, blocking the loop of the stream.
+
+        The status messages are read here as soon as they arrive.
+        """
+        deadline = time.monotonic() + timeout
+        self.stream.flush()
+        while not self.idle.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if self.stream.socket.poll(remaining * 1000):
+                self.stream.flush()
+        return True
+
+    def close(self):
+        self.stream.close()
+        self.executing_kernel_ids.discard(self.kernel_id)
+
+
+class LCWrapperKernelManager(IOLoopKernelManager):
+    """Kernel manager for LC_wrapper kernel"""
+
+    in_place_restart = Bool(True, config=True,
+                            help='Restart only the wrapped kernel, keeping the wrapper kernel process.')
+
+    in_place_restart_timeout = Float(60, config=True,
+                                     help='Seconds to wait for the in-place restart before restarting the process.')
+
+    shutdown_wait_time = Float(5.0, config=True,
+                               help='Seconds to wait at most for an interrupted execution to finish before shutting down.')
+
+    _state_watcher = None
+
+    def start_kernel(self, **kw):
+        super(LCWrapperKernelManager, self).start_kernel(**kw)
+
+        self.start_watching_execution_state()
+
+    def start_watching_execution_state(self):
+        self.stop_watching_execution_state()
+        self._state_watcher = ExecutionStateWatcher(self)
+
+    def stop_watching_execution_state(self):
+        if self._state_watcher is not None:
+            self._state_watcher.close()
+            self._state_watcher = None
+
+    def _wait_for_idle(self):
+        if self._state_watcher is None:
+            return
+        self.log.debug("waiting for kernel to become idle")
+        if self._state_watcher.wait_for_idle_blocking(self.shutdown_wait_time):
+            self.log.debug("kernel become idle")
+        else:
+            self.log.debug("kernel did not become idle in %.1fs", self.shutdown_wait_time)
+
+    def restart_kernel(self, now=False, newports=False, **kw):
+        if self.in_place_restart and not now and not newports and not kw:
+            if self._restart_in_place():
+                return
+        super(LCWrapperKernelManager, self).restart_kernel(now=now, newports=newports, **kw)
+        # a new process, possibly on new ports
+        self.start_watching_execution_state()
+
+    def _restart_in_place(self):
+        # a socket of its own: the replies to request_shutdown() are
+        # never read from the control socket of the manager
+        socket = KernelManager.connect_control(self)
+        try:
+            msg = self.session.msg('shutdown_request',
+                                   {'restart': True, IN_PLACE_RESTART_KEY: True})
+            self.session.send(socket, msg)
+            if not socket.poll(self.in_place_restart_timeout * 1000):
+                self.log.warning("In-place restart timed out")
+                return False
+            idents, msg_list = self.session.feed_identities(socket.recv_multipart())
+            reply = self.session.deserialize(msg_list)
+        finally:
+            socket.close(linger=0)
+        content = reply['content']
+        return content.get('status') == 'ok' and content.get(IN_PLACE_RESTART_KEY, False)
+
+    def shutdown_kernel(self, now=False, restart=False):
+        # Stop monitoring for restarting while we shutdown.
+        self.stop_restarter()
+
+        self.log.debug("Interrupting the wrapper kernel and its subprocesses")
+        self.interrupt_kernel()
+        self._wait_for_idle()
+        self.stop_watching_execution_state()
+
+        if now:
+            self._kill_kernel()
+        else:
+            self.request_shutdown(restart=restart)
+            # Don't send any additional kernel kill messages immediately, to give
+            # the kernel a chance to properly execute shutdown actions. Wait for at
+            # most 1s, checking every 0.1s.
+            self.finish_shutdown()
+
+        self.cleanup_resources(restart=restart)
@@ -0,0 +1,516 @@
+from bisect import bisect_right
+from itertools import accumulate
+import re
+from time import perf_counter
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+HIGHLIGHT = u'\033[0;31m{}\033[0m'
+
+# the leading literals taken from a pattern
+MAX_PREFIX_LENGTH = 8
+MAX_PREFIXES = 64
+
+_ZERO_WIDTH = (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT)
+_REPEAT = tuple(getattr(sre_constants, name) for name in
+                ['MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT']
+                if hasattr(sre_constants, name))
+_ATOMIC_GROUP = getattr(sre_constants, 'ATOMIC_GROUP', None)
+_POSSESSIVE_REPEAT = getattr(sre_constants, 'POSSESSIVE_REPEAT', None)
+_LOOKAROUND = (sre_constants.ASSERT, sre_constants.ASSERT_NOT)
+
+
+_NOT_SEARCHED = object()
+
+
+class _TooManyPrefixes(Exception):
+    pass
+
+
+def _prefixes(items, prefix):
+    """Return the literals one of which starts every match of `items`."""
+    if len(items) == 0 or len(prefix) >= MAX_PREFIX_LENGTH:
+        return {prefix}
+    op, av = items[0]
+    rest = items[1:]
+    if op is sre_constants.LITERAL:
+        result = _prefixes(rest, prefix + chr(av))
+    elif op in _ZERO_WIDTH:
+        result = _prefixes(rest, prefix)
+    elif op is sre_constants.SUBPATTERN:
+        group, add_flags, del_flags, p = av
+        if add_flags or del_flags:
+            return {prefix}
+        result = _prefixes(list(p) + rest, prefix)
+    elif op is _ATOMIC_GROUP:
+        result = _prefixes(list(av), prefix)
+    elif op is sre_constants.BRANCH:
+        result = set()
+        for alternative in av[1]:
+            result |= _prefixes(list(alternative) + rest, prefix)
+    elif op in _REPEAT:
+        min_count, max_count, item = av
+        if max_count == 1:
+            result = _prefixes(list(item) + rest, prefix)
+        else:
+            # the first of the repeated items only
+            result = _prefixes(list(item), prefix)
+        if min_count == 0:
+            result |= _prefixes(rest, prefix)
+    elif op is sre_constants.IN and \
+            all(o is sre_constants.LITERAL for o, _ in av) and len(av) <= 8:
+        result = set()
+        for _, c in av:
+            result |= _prefixes(rest, prefix + chr(c))
+    else:
+        return {prefix}
+    if len(result) > MAX_PREFIXES:
+        raise _TooManyPrefixes()
+    return result
+
+
+def literal_prefixes(pattern):
+    """Return the literals one of which starts every match of `pattern`.
+
+    None if some match may start with any character, e.g. with a leading
+    character class or case-insensitive matching.
+    """
+    if not isinstance(pattern.pattern, str) or pattern.flags & re.IGNORECASE:
+        return None
+    try:
+        prefixes = _prefixes(list(sre_parse.parse(pattern.pattern, pattern.flags)), u'')
+    except (_TooManyPrefixes, RecursionError, re.error):
+        return None
+    if u'' in prefixes:
+        return None
+    # a prefix starting with another one adds no candidate
+    shortest = []
+    for p in sorted(prefixes, key=lambda p: (len(p), p)):
+        if not any(p.startswith(s) for s in shortest):
+            shortest.append(p)
+    return shortest
+
+
+def _best(candidates):
+    """Return the most selective of the sets of literals, or None."""
+    best = None
+    for literals in candidates:
+        if len(literals) == 0 or len(literals) > MAX_PREFIXES:
+            continue
+        score = (min(len(s) for s in literals), -len(literals))
+        if best is None or score > best[0]:
+            best = (score, literals)
+    return None if best is None else best[1]
+
+
+def _required(items):
+    """Return literals one of which is in every match of `items`, or None."""
+    candidates = []
+    run = u''
+    for op, av in items:
+        if op is sre_constants.LITERAL:
+            run += chr(av)
+            continue
+        if op in _ZERO_WIDTH:
+            # the literals around it are still adjacent in the match
+            continue
+        if len(run) > 0:
+            candidates.append({run})
+            run = u''
+        if op is sre_constants.SUBPATTERN:
+            group, add_flags, del_flags, p = av
+            if add_flags or del_flags:
+                continue
+            literals = _required(list(p))
+        elif op is _ATOMIC_GROUP:
+            literals = _required(list(av))
+        elif op is sre_constants.BRANCH:
+            literals = set()
+            for alternative in av[1]:
+                found = _required(list(alternative))
+                if found is None:
+                    literals = None
+                    break
+                literals |= found
+        elif op in _REPEAT and av[0] >= 1:
+            literals = _required(list(av[2]))
+        elif op is sre_constants.IN and \
+                all(o is sre_constants.LITERAL for o, _ in av) and len(av) <= 8:
+            literals = {chr(c) for _, c in av}
+        else:
+            literals = None
+        if literals is not None:
+            candidates.append(literals)
+    if len(run) > 0:
+        candidates.append({run})
+    return _best(candidates)
+
+
+def required_literals(pattern):
+    """Return the literals one of which is in every match of `pattern`.
+
+    None if no such literal could be found, e.g. in a pattern made of
+    character classes only or matching case-insensitively. A line
+    containing none of them cannot match the pattern.
+    """
+    if not isinstance(pattern.pattern, str) or pattern.flags & re.IGNORECASE:
+        return None
+    try:
+        literals = _required(list(sre_parse.parse(pattern.pattern, pattern.flags)))
+    except (RecursionError, re.error):
+        return None
+    if literals is None:
+        return None
+    # a literal containing another one adds no candidate line
+    shortest = []
+    for s in sorted(literals, key=lambda s: (len(s), s)):
+        if not any(t in s for t in shortest):
+            shortest.append(s)
+    return shortest
+
+
+def _first_chars(items):
+    """Return the characters which may start a match of `items`, or None."""
+    try:
+        prefixes = _prefixes(items, u'')
+    except _TooManyPrefixes:
+        return None
+    if u'' in prefixes:
+        return None
+    return set(p[0] for p in prefixes)
+
+
+def _ambiguous_branch(alternatives):
+    """Whether two of `alternatives` may match at the same place."""
+    first_chars = []
+    for alternative in alternatives:
+        if alternative.getwidth()[0] == 0:
+            # matched again and again at the same place
+            return True
+        alternative = list(alternative)
+        chars = _first_chars(alternative)
+        if chars is None:
+            continue
+        if any(chars & other for other in first_chars):
+            return True
+        first_chars.append(chars)
+    return False
+
+
+def _superlinear(items, repeated):
+    """Return what in `items` may backtrack exponentially, or None.
+
+    `repeated` is whether `items` are in an unbounded repeat.
+    """
+    for op, av in items:
+        if op is sre_constants.GROUPREF or op is sre_constants.GROUPREF_EXISTS:
+            return u'backreference'
+        if op is _ATOMIC_GROUP or op is _POSSESSIVE_REPEAT:
+            # no backtracking into them
+            continue
+        if op is sre_constants.SUBPATTERN:
+            reason = _superlinear(list(av[3]), repeated)
+        elif op is sre_constants.BRANCH:
+            if repeated and _ambiguous_branch(av[1]):
+                return u'alternatives matching the same text in a repeat'
+            reason = None
+            for alternative in av[1]:
+                reason = reason or _superlinear(list(alternative), repeated)
+        elif op in _LOOKAROUND:
+            reason = _superlinear(list(av[1]), repeated)
+        elif op in _REPEAT:
+            min_count, max_count, item = av
+            if repeated and max_count > min_count:
+                return u'nested repeats'
+            reason = _superlinear(list(item), repeated or max_count == sre_constants.MAXREPEAT)
+        else:
+            reason = None
+        if reason is not None:
+            return reason
+    return None
+
+
+def _leading_repeat(items):
+    """Whether `items` start with an unbounded repeat followed by more to match."""
+    items = [(op, av) for op, av in items if op not in _ZERO_WIDTH]
+    while len(items) > 0 and items[0][0] is sre_constants.SUBPATTERN:
+        items = [(op, av) for op, av in list(items[0][1][3]) + items[1:]
+                 if op not in _ZERO_WIDTH]
+    if len(items) < 2:
+        return False
+    op, av = items[0]
+    return op in _REPEAT and op is not _POSSESSIVE_REPEAT and \
+        av[1] == sre_constants.MAXREPEAT
+
+
+def superlinear_reason(pattern):
+    """Return why searching with `pattern` may take more than linear time, or None.
+
+    Backreferences, nested repeats and alternatives which may match the
+    same text in a repeat may backtrack exponentially on a line which
+    almost matches. A leading unbounded repeat is tried again from each
+    position of a line without a match, in quadratic time.
+    """
+    try:
+        items = list(sre_parse.parse(pattern.pattern, pattern.flags))
+    except (RecursionError, re.error):
+        return None
+    reason = _superlinear(items, False)
+    if reason is None and _leading_repeat(items):
+        reason = u'leading unbounded repeat'
+    return reason
+
+
+def _trie_pattern(words):
+    """Return a regex matching `words`, with the common prefixes factored out.
+
+    At each position, the regex engine then tries the alternatives of one
+    character instead of every word.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for c in word:
+            node = node.setdefault(c, {})
+        node[u''] = None
+
+    def build(node):
+        if u'' in node:
+            # a match may start here whatever follows
+            return u''
+        alternatives = [re.escape(c) + build(child) for c, child in sorted(node.items())]
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return u'(?:{})'.format(u'|'.join(alternatives))
+    return build(trie)
+
+
+class _TimedPattern(object):
+    """A compiled pattern whose searches are timed, until it is skipped."""
+
+    def __init__(self, regex):
+        self.regex = regex
+        self.pattern = regex.pattern
+        self.flags = regex.flags
+        self.elapsed = 0.0
+        self.skipped = False
+
+    def search(self, text, pos=0):
+        if self.skipped:
+            return None
+        start = perf_counter()
+        try:
+            return self.regex.search(text, pos)
+        finally:
+            self.elapsed += perf_counter() - start
+
+    def match(self, text, pos=0):
+        if self.skipped:
+            return None
+        start = perf_counter()
+        try:
+            return self.regex.match(text, pos)
+        finally:
+            self.elapsed += perf_counter() - start
+
+
+class KeywordMatcher(object):
+    """Highlight the keywords matched by a list of patterns in a line.
+
+    The leading literals of the patterns are compiled into one regex, a
+    trie of alternations, which finds in a single scan the positions where
+    a match may start.
+    The patterns are then only tried at these positions, and the longest
+    keyword at the leftmost matched position is highlighted, as searching
+    with each pattern in turn did. Patterns without leading literals are
+    searched one by one.
+
+    Before any pattern runs, a line is rejected if it contains none of the
+    literals required by the patterns, the leading ones or those found
+    further in the patterns. Patterns without any required literal are
+    always searched, and lines cannot be rejected while there are some.
+    `lines_checked`, `lines_rejected` and `lines_matched` count the lines
+    given to `highlight()`.
+
+    Lines longer than `max_line_length` characters are not matched, and
+    with a `line_budget` in seconds the patterns are timed: a line which
+    takes longer is not highlighted, and the pattern which took longer on
+    its own is skipped from then on, since a running search cannot be
+    stopped. Both are counted in `lines_over_budget`, and the skipped
+    patterns are listed in `skipped_patterns`.
+    """
+
+    def __init__(self, patterns, max_line_length=None, line_budget=None):
+        self.patterns = list(patterns)
+        self.max_line_length = max_line_length
+        self.line_budget = line_budget
+        patterns = self.patterns
+        if line_budget is not None:
+            patterns = [_TimedPattern(p) for p in patterns]
+        self._patterns = patterns
+        prefixes = set()
+        required = set()
+        self.prefixed_patterns = []
+        self.searched_patterns = []
+        self.filtered_patterns = []
+        self.unfiltered_patterns = []
+        for p in patterns:
+            literals = literal_prefixes(p)
+            if literals is not None:
+                prefixes.update(literals)
+                self.prefixed_patterns.append(p)
+                continue
+            self.searched_patterns.append(p)
+            literals = required_literals(p)
+            if literals is None:
+                self.unfiltered_patterns.append(p)
+            else:
+                required.update(literals)
+                self.filtered_patterns.append((p, literals))
+        self.start_finder = None
+        if len(prefixes) > 0:
+            self.start_finder = re.compile(_trie_pattern(prefixes))
+        self.prefilter = None
+        if len(required) == 0:
+            self.prefilter = self.start_finder
+        else:
+            self.prefilter = re.compile(_trie_pattern(prefixes | required))
+        self.lines_checked = 0
+        self.lines_rejected = 0
+        self.lines_matched = 0
+        self.lines_over_budget = 0
+        self.skipped_patterns = []
+
+    def _leftmost(self, text, first=_NOT_SEARCHED):
+        """Return the start of the leftmost match and the longest keyword there.
+
+        `first` is where the prefilter found its first literal in `text`, or
+        None if it found none, when already searched.
+        """
+        left = None
+        for p in self.unfiltered_patterns:
+            m = p.search(text)
+            if m is not None and (left is None or m.start() < left):
+                left = m.start()
+        if first is _NOT_SEARCHED:
+            hit = None if self.prefilter is None else self.prefilter.search(text)
+            first = None if hit is None else hit.start()
+        if first is not None:
+            for p, literals in self.filtered_patterns:
+                if not any(s in text for s in literals):
+                    continue
+                m = p.search(text)
+                if m is not None and (left is None or m.start() < left):
+                    left = m.start()
+        if first is not None and self.start_finder is not None:
+            # no leading literal starts before the first required one
+            pos = first
+            while True:
+                candidate = self.start_finder.search(text, pos)
+                if candidate is None:
+                    break
+                start = candidate.start()
+                if left is not None and start >= left:
+                    break
+                if any(p.match(text, start) is not None for p in self.prefixed_patterns):
+                    left = start
+                    break
+                pos = start + 1
+        if left is None:
+            return None
+        keyword = None
+        for p in self._patterns:
+            m = p.match(text, left)
+            if m is not None and (keyword is None or len(m.group()) > len(keyword)):
+                keyword = m.group()
+        return left, keyword
+
+    def highlight(self, text):
+        """Return `text` with the keywords highlighted, or None if no pattern matches."""
+        self.lines_checked += 1
+        first = None
+        if self.prefilter is not None:
+            hit = self.prefilter.search(text)
+            if hit is None and len(self.unfiltered_patterns) == 0:
+                self.lines_rejected += 1
+                return None
+            first = None if hit is None else hit.start()
+        return self._highlight(text, first)
+
+    def highlight_lines(self, text, lines):
+        """Return the lines of `text` with keywords, highlighted as by `highlight()`.
+
+        `lines` is `text.splitlines()`. The prefilter scans the whole text
+        once, and only the lines where it finds a literal are matched.
+        """
+        if self.prefilter is None or len(self.unfiltered_patterns) > 0:
+            return [h for h in map(self.highlight, lines) if h is not None]
+        self.lines_checked += len(lines)
+        self.lines_rejected += len(lines)
+        result = []
+        starts = None
+        hit = self.prefilter.search(text)
+        while hit is not None:
+            if starts is None:
+                starts = [0]
+                starts.extend(accumulate(map(len, text.splitlines(True))))
+            i = bisect_right(starts, hit.start()) - 1
+            self.lines_rejected -= 1
+            highlighted = self._highlight(lines[i], hit.start() - starts[i])
+            if highlighted is not None:
+                result.append(highlighted)
+            hit = self.prefilter.search(text, starts[i + 1])
+        return result
+
+    def _highlight(self, text, first):
+        if self.max_line_length is not None and len(text) > self.max_line_length:
+            self.lines_over_budget += 1
+            return None
+        if self.line_budget is None:
+            return self._highlight_keywords(text, first)
+        elapsed = [p.elapsed for p in self._patterns]
+        start = perf_counter()
+        highlighted = self._highlight_keywords(text, first)
+        if perf_counter() - start <= self.line_budget:
+            return highlighted
+        self.lines_over_budget += 1
+        if highlighted is not None:
+            self.lines_matched -= 1
+        for p, e in zip(self._patterns, elapsed):
+            if p.elapsed - e > self.line_budget:
+                self.skip_pattern(p.pattern)
+        return None
+
+    def skip_pattern(self, pattern):
+        """Stop searching with the timed pattern whose text is `pattern`."""
+        for p in self._patterns:
+            if p.pattern == pattern and not p.skipped:
+                p.skipped = True
+                self.skipped_patterns.append(pattern)
+
+    def _highlight_keywords(self, text, first):
+        found = self._leftmost(text, first)
+        if found is None:
+            return None
+        self.lines_matched += 1
+        remain = text
+        result = []
+        while found is not None:
+            left, keyword = found
+            result.append(remain[:left])
+            result.append(HIGHLIGHT.format(keyword))
+            if len(keyword) == 0:
+                # an empty keyword would be found again at the same place
+                if left == len(remain):
+                    remain = u''
+                    break
+                left += 1
+                result.append(remain[left - 1:left])
+            remain = remain[left + len(keyword):]
+            found = self._leftmost(remain)
+        result.append(remain)
+        return u''.join(result)
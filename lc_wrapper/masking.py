@@ -0,0 +1,362 @@
+from collections import deque
+import re
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+from .keywords import literal_prefixes
+
+MASK_CHAR = u'*'
+
+_LOOKAROUND = (sre_constants.ASSERT, sre_constants.ASSERT_NOT)
+_REPEAT = tuple(getattr(sre_constants, name) for name in
+                ['MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT']
+                if hasattr(sre_constants, name))
+_ATOMIC_GROUP = getattr(sre_constants, 'ATOMIC_GROUP', None)
+# the categories of a character set which contain '\n'
+_NEWLINE_CATEGORIES = tuple(getattr(sre_constants, name) for name in
+                            ['CATEGORY_SPACE', 'CATEGORY_NOT_DIGIT',
+                             'CATEGORY_NOT_WORD', 'CATEGORY_LINEBREAK'])
+
+
+def _in_matches_newline(items):
+    negate = False
+    found = False
+    for op, av in items:
+        if op is sre_constants.NEGATE:
+            negate = True
+        elif op is sre_constants.LITERAL:
+            found = found or av == 10
+        elif op is sre_constants.RANGE:
+            found = found or av[0] <= 10 <= av[1]
+        elif op is sre_constants.CATEGORY:
+            found = found or av in _NEWLINE_CATEGORIES
+        else:
+            return True
+    return found != negate
+
+
+def _scan(items, dotall):
+    """Return whether `items` may match '\\n' and the widest lookaround in them."""
+    newline = False
+    lookaround = 0
+    for op, av in items:
+        subpatterns = []
+        if op is sre_constants.LITERAL:
+            newline = newline or av == 10
+        elif op is sre_constants.NOT_LITERAL:
+            newline = newline or av != 10
+        elif op is sre_constants.ANY:
+            newline = newline or dotall
+        elif op is sre_constants.IN:
+            newline = newline or _in_matches_newline(av)
+        elif op in (sre_constants.AT, sre_constants.GROUPREF):
+            # a reference matches again what its group matched
+            pass
+        elif op is sre_constants.SUBPATTERN:
+            group, add_flags, del_flags, p = av
+            n, width = _scan(p, (dotall or bool(add_flags & re.DOTALL)) and
+                             not del_flags & re.DOTALL)
+            newline = newline or n
+            lookaround = max(lookaround, width)
+        elif op is _ATOMIC_GROUP:
+            subpatterns = [av]
+        elif op is sre_constants.BRANCH:
+            subpatterns = av[1]
+        elif op in _REPEAT:
+            subpatterns = [av[2]]
+        elif op in _LOOKAROUND:
+            lookaround = max(lookaround, min(av[1].getwidth()[1], sre_constants.MAXREPEAT))
+            subpatterns = [av[1]]
+        elif op is sre_constants.GROUPREF_EXISTS:
+            subpatterns = [p for p in av[1:] if p is not None]
+        else:
+            newline = True
+        for p in subpatterns:
+            n, width = _scan(p, dotall)
+            newline = newline or n
+            lookaround = max(lookaround, width)
+    return newline, lookaround
+
+
+def _anchored(items):
+    """Whether `items` hold an anchor other than \\b and \\B."""
+    for op, av in items:
+        subpatterns = []
+        if op is sre_constants.AT:
+            if av not in (sre_constants.AT_BOUNDARY, sre_constants.AT_NON_BOUNDARY):
+                return True
+        elif op is sre_constants.SUBPATTERN:
+            subpatterns = [av[3]]
+        elif op is _ATOMIC_GROUP:
+            subpatterns = [av]
+        elif op is sre_constants.BRANCH:
+            subpatterns = av[1]
+        elif op in _REPEAT:
+            subpatterns = [av[2]]
+        elif op in _LOOKAROUND:
+            subpatterns = [av[1]]
+        elif op is sre_constants.GROUPREF_EXISTS:
+            subpatterns = [p for p in av[1:] if p is not None]
+        if any(_anchored(p) for p in subpatterns):
+            return True
+    return False
+
+
+class LiteralMatcher(object):
+    """Find literal strings in a text with an Aho-Corasick automaton.
+
+    The automaton finds every occurrence of the strings in one pass over
+    the text, whatever their number. It only runs over the runs of
+    characters used by the strings which are long enough to hold one of
+    them; a compiled regex finds these runs.
+    """
+
+    def __init__(self, words):
+        self.words = sorted(set(w for w in words if len(w) > 0))
+        self.max_length = max([len(w) for w in self.words] or [0])
+        self.min_length = min([len(w) for w in self.words] or [0])
+        # the transitions, failure links and depth of each state, and the
+        # length of the longest word which ends at it
+        self._goto = [{}]
+        self._fail = [0]
+        self._depth = [0]
+        self._out = [0]
+        for word in self.words:
+            state = 0
+            for c in word:
+                nxt = self._goto[state].get(c)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._depth.append(self._depth[state] + 1)
+                    self._out.append(0)
+                    self._goto[state][c] = nxt
+                state = nxt
+            self._out[state] = len(word)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, nxt in self._goto[state].items():
+                fail = self._fail[state]
+                while fail != 0 and c not in self._goto[fail]:
+                    fail = self._fail[fail]
+                if state != 0 and c in self._goto[fail]:
+                    fail = self._goto[fail][c]
+                self._fail[nxt] = fail
+                self._out[nxt] = max(self._out[nxt], self._out[fail])
+                queue.append(nxt)
+        # the length of the longest suffix which may still become a word
+        self._hold = list(self._depth)
+        for state in range(len(self._goto)):
+            s = state
+            while s != 0 and len(self._goto[s]) == 0:
+                s = self._fail[s]
+            self._hold[state] = self._depth[s]
+        self._runs = None
+        if len(self.words) > 0:
+            chars = sorted(set(u''.join(self.words)))
+            self._runs = re.compile(u'[{}]{{{},}}'.format(
+                u''.join(re.escape(c) for c in chars), self.min_length))
+
+    def _run(self, text, start, end, spans):
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        state = 0
+        for i, c in enumerate(text[start:end], start + 1):
+            while True:
+                nxt = goto[state].get(c)
+                if nxt is not None:
+                    state = nxt
+                    break
+                if state == 0:
+                    break
+                state = fail[state]
+            if out[state]:
+                spans.append((i - out[state], i))
+        return state
+
+    def spans(self, text):
+        """Return the spans of the occurrences of the strings in `text`."""
+        spans = []
+        if self._runs is not None:
+            for m in self._runs.finditer(text):
+                self._run(text, m.start(), m.end(), spans)
+        return spans
+
+    def partial(self, text):
+        """Return the length of the end of `text` which may start an occurrence."""
+        if self._runs is None:
+            return 0
+        start = max(0, len(text) - self.max_length)
+        return self._hold[self._run(text, start, len(text), [])]
+
+
+def _masked(text, start, end, spans):
+    """Return `text[start:end]` with the characters in `spans` masked."""
+    result = []
+    pos = start
+    for s, e in sorted(spans):
+        s = max(s, pos)
+        e = min(e, end)
+        if s >= e:
+            continue
+        result.append(text[pos:s])
+        result.append(MASK_CHAR * (e - s))
+        pos = e
+    result.append(text[pos:end])
+    return u''.join(result)
+
+
+def mask_text(text, pattern=None, literals=None):
+    """Mask the matches of `pattern`, a regex or its text, and the strings
+    of the `LiteralMatcher` `literals` in `text`."""
+    spans = []
+    if pattern is not None:
+        spans.extend(m.span() for m in re.compile(pattern).finditer(text))
+    if literals is not None:
+        spans.extend(literals.spans(text))
+    if len(spans) == 0:
+        return text
+    return _masked(text, 0, len(text), spans)
+
+
+class StreamMasker(object):
+    """Mask the matches of a pattern and the strings of a `LiteralMatcher`
+    in text received in chunks.
+
+    `feed()` returns the masked text which no later chunk can change, and
+    holds back the end of the text that may still be the start of a match,
+    so that a secret split across chunks is masked as a whole. `flush()`
+    returns the held text, masked as if the stream ended there.
+
+    A chunk ending with a line break is returned at once if the masker is
+    `line_independent`.
+
+    At most `max_carry` characters are held back: as many as the longest
+    match of the pattern, if it is bounded, from the first position
+    where a match of the pattern may start. A pattern which cannot match a
+    line break holds back the last incomplete line at most. For the
+    strings, only the end of the text which is the start of one of them is
+    held back.
+    """
+
+    def __init__(self, pattern, max_carry=1024, literals=None):
+        if pattern is not None:
+            pattern = re.compile(pattern)
+        self.pattern = pattern
+        self.literals = literals
+        self.max_carry = max_carry
+        self.line_bounded = True
+        self.window = 0
+        self.prefixes = None
+        self._starts = None
+        lookaround = 0
+        anchored = False
+        if pattern is not None:
+            parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+            newline, lookaround = _scan(list(parsed), bool(pattern.flags & re.DOTALL))
+            self.line_bounded = not newline and lookaround == 0
+            anchored = _anchored(list(parsed))
+            width = parsed.getwidth()[1]
+            self.window = min(width + lookaround + 1, max_carry)
+            self.prefixes = literal_prefixes(pattern)
+            if self.prefixes is not None:
+                first_chars = sorted(set(p[0] for p in self.prefixes))
+                self._starts = re.compile(u'[{}]'.format(
+                    u''.join(re.escape(c) for c in first_chars)))
+        # the characters before the held text seen by lookbehinds and \b,
+        # and by the strings which start in the text already returned
+        self.context_size = min(lookaround + 1, max_carry)
+        if literals is not None:
+            self.context_size = max(self.context_size, literals.max_length - 1)
+        # the complete lines of a chunk may then be masked apart, with
+        # `mask_text()`, since no match depends on the text around them
+        self.line_independent = self.line_bounded and not anchored and \
+            (literals is None or not any(u'\n' in w for w in literals.words))
+        self._context = u''
+        self._carry = u''
+
+    @property
+    def held(self):
+        return len(self._carry)
+
+    def _may_start(self, text, pos):
+        rest = len(text) - pos
+        for p in self.prefixes:
+            if len(p) <= rest:
+                if text.startswith(p, pos):
+                    return True
+            elif p.startswith(text[pos:]):
+                return True
+        return False
+
+    def _hold_from(self, text, pos):
+        """Return the first position from `pos` where a match may start."""
+        if pos >= len(text) or self._starts is None:
+            return pos
+        while True:
+            m = self._starts.search(text, pos)
+            if m is None:
+                return len(text)
+            if self._may_start(text, m.start()):
+                return m.start()
+            pos = m.start() + 1
+
+    def _match_spans(self, text, start, end, spans):
+        """Add the spans of the matches from `start` which start before `end`.
+
+        Return where they stop: at `end`, or after a match crossing `end`.
+        """
+        pos = start
+        for m in self.pattern.finditer(text, start):
+            if m.start() >= end:
+                break
+            spans.append(m.span())
+            pos = m.end()
+        return max(pos, end)
+
+    def feed(self, text):
+        """Return the masked text of the chunks which is complete."""
+        start = len(self._context)
+        buff = self._context + self._carry + text
+        spans = []
+        hold = len(buff)
+        if self.pattern is not None:
+            cut = max(start, len(buff) - self.window)
+            if self.line_bounded:
+                cut = max(cut, buff.rfind(u'\n', start) + 1)
+            pos = self._match_spans(buff, start, cut, spans)
+            hold = self._hold_from(buff, pos)
+        if self.literals is not None:
+            partial = min(self.literals.partial(buff), self.max_carry, len(buff) - start)
+            if len(buff) - partial < hold:
+                hold = len(buff) - partial
+                # a match of the pattern is returned as a whole
+                for s, e in spans:
+                    if s < hold < e:
+                        hold = e
+            spans.extend(self.literals.spans(buff))
+        masked = _masked(buff, start, hold, spans)
+        self._context = buff[max(0, hold - self.context_size):hold]
+        self._carry = buff[hold:]
+        return masked
+
+    def flush(self):
+        """Return the masked text held back and forget the stream."""
+        start = len(self._context)
+        buff = self._context + self._carry
+        spans = []
+        if self.pattern is not None:
+            self._match_spans(buff, start, len(buff), spans)
+        if self.literals is not None:
+            spans.extend(self.literals.spans(buff))
+        masked = _masked(buff, start, len(buff), spans)
+        self._context = u''
+        self._carry = u''
+        return masked
@@ -0,0 +1,7 @@
+"""Message fields shared by the wrapper kernel and its kernel managers.
+
+Kept apart from both, so that each side imports it without the other.
+"""
+
+# shutdown_request content flag: restart only the wrapped kernel
+IN_PLACE_RESTART_KEY = 'lc_wrapper_in_place'
@@ -0,0 +1,116 @@
+import concurrent.futures
+import multiprocessing
+
+from .masking import mask_text
+
+# the state of a worker process, set when it starts
+_masking_pattern = None
+_masking_literals = None
+_keyword_matcher = None
+
+
+def _init_worker(masking_pattern, masking_literals, keyword_matcher):
+    global _masking_pattern, _masking_literals, _keyword_matcher
+    _masking_pattern = masking_pattern
+    _masking_literals = masking_literals
+    _keyword_matcher = keyword_matcher
+
+
+def _mask(text):
+    return mask_text(text, _masking_pattern, _masking_literals)
+
+
+def _highlight_lines(text):
+    matcher = _keyword_matcher
+    counts = _counts(matcher)
+    skipped = len(matcher.skipped_patterns)
+    highlighted = matcher.highlight_lines(text, text.splitlines())
+    counts = [n - m for n, m in zip(_counts(matcher), counts)]
+    return highlighted, counts, matcher.skipped_patterns[skipped:]
+
+
+def _counts(matcher):
+    return [matcher.lines_checked, matcher.lines_rejected, matcher.lines_matched,
+            matcher.lines_over_budget]
+
+
+class OutputProcessPool(object):
+    """Mask and scan the lines of large stream chunks in worker processes.
+
+    A chunk of at least `min_chars` characters is cut at line breaks into
+    a piece for each of the `processes` workers, and the results of the
+    pieces are joined in the order of the chunk. The calls wait for the
+    results, so the messages are still processed one after the other.
+
+    The workers are started with the masking pattern and strings and the
+    `KeywordMatcher` given to `configure()`, and restarted when they
+    change. The counters of the matcher are updated with those of the
+    workers. A pattern skipped by the line budget of a worker is also
+    skipped by the matcher, but each worker skips it on its own.
+    """
+
+    def __init__(self, processes, min_chars=65536):
+        self.processes = processes
+        self.min_chars = min_chars
+        self.chunks = 0
+        self.masking_pattern = None
+        self.masking_literals = None
+        self.keyword_matcher = None
+        self._executor = None
+
+    def configure(self, masking_pattern, masking_literals, keyword_matcher):
+        state = (masking_pattern, masking_literals, keyword_matcher)
+        if self._executor is not None and masking_pattern is self.masking_pattern and \
+                masking_literals is self.masking_literals and \
+                keyword_matcher is self.keyword_matcher:
+            return
+        self.shutdown()
+        self.masking_pattern, self.masking_literals, self.keyword_matcher = state
+        # the kernel runs threads, which a forked process would not have
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.processes, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker, initargs=state)
+
+    def split(self, text):
+        """Return `text` cut after line breaks into pieces for the workers,
+        or None if it is too short to be worth it."""
+        if self._executor is None or len(text) < self.min_chars:
+            return None
+        size = max(len(text) // self.processes, 1)
+        pieces = []
+        start = 0
+        while start < len(text):
+            end = text.find(u'\n', start + size) + 1
+            if end == 0:
+                end = len(text)
+            pieces.append(text[start:end])
+            start = end
+        if len(pieces) < 2:
+            return None
+        self.chunks += 1
+        return pieces
+
+    def mask(self, pieces):
+        """Return the masked text of `pieces`, the complete lines of a stream."""
+        return u''.join(self._executor.map(_mask, pieces))
+
+    def highlight_lines(self, pieces):
+        """Return the lines of `pieces` with keywords, as by
+        `KeywordMatcher.highlight_lines()`."""
+        matcher = self.keyword_matcher
+        result = []
+        # all the pieces are done before the counters are updated
+        for highlighted, counts, skipped in list(self._executor.map(_highlight_lines, pieces)):
+            result.extend(highlighted)
+            matcher.lines_checked += counts[0]
+            matcher.lines_rejected += counts[1]
+            matcher.lines_matched += counts[2]
+            matcher.lines_over_budget += counts[3]
+            for p in skipped:
+                matcher.skip_pattern(p)
+        return result
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._executor = None
@@ -0,0 +1,309 @@
+import asyncio
+import errno
+import fcntl
+import os
+import stat
+import tempfile
+import time
+from contextlib import contextmanager
+
+from jupyter_client.multikernelmanager import AsyncMultiKernelManager
+from tornado.ioloop import IOLoop
+from traitlets import Float, Integer, List, Unicode, default
+from traitlets.config import LoggingConfigurable
+
+from .kernelmanager import ExecutionStateWatcher
+
+
+class HostSlots(LoggingConfigurable):
+    """Count the warm kernels of all the pools on this host.
+
+    A slot is a file named `<pid>-<kernel_id>` in `slot_dir`, which is shared
+    by the users of the host. Only the slots of a running process, owned by
+    the user of that process, are counted, so that a user cannot take the
+    slots of the others by creating files. The lock of `slot_dir` is given
+    up after `lock_timeout` seconds with a TimeoutError.
+    """
+
+    slot_dir = Unicode()
+    limit = Integer(0)
+    lock_timeout = Float(10)
+
+    @contextmanager
+    def _locked(self):
+        if not os.path.isdir(self.slot_dir):
+            os.makedirs(self.slot_dir, exist_ok=True)
+            try:
+                os.chmod(self.slot_dir, 0o1777)
+            except OSError:
+                pass
+        lock_path = os.path.join(self.slot_dir, '.lock')
+        # flock() needs no write access, so the other users can lock the
+        # file they do not own
+        fd = os.open(lock_path, os.O_RDONLY | os.O_CREAT, 0o666)
+        try:
+            os.fchmod(fd, 0o666)
+        except OSError:
+            pass
+        try:
+            self._lock(fd)
+            yield
+        finally:
+            os.close(fd)
+
+    def _lock(self, fd):
+        # another user may hold the lock for any time
+        deadline = time.monotonic() + self.lock_timeout
+        delay = 0.001
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(errno.ETIMEDOUT, 'cannot lock the slots',
+                                       self.slot_dir)
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+    def _slots(self):
+        slots = []
+        for name in os.listdir(self.slot_dir):
+            pid, _, kernel_id = name.partition('-')
+            if not pid.isdigit() or not kernel_id:
+                continue
+            path = os.path.join(self.slot_dir, name)
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue
+            if not stat.S_ISREG(st.st_mode) or not _is_running_as(int(pid), st.st_uid):
+                # removed if this user may, e.g. the slots of its dead processes
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            slots.append(name)
+        return slots
+
+    def acquire(self, kernel_id):
+        """Take a slot for `kernel_id`; return False if the host is full."""
+        if self.limit <= 0:
+            return True
+        with self._locked():
+            if len(self._slots()) >= self.limit:
+                return False
+            path = os.path.join(self.slot_dir, '{}-{}'.format(os.getpid(), kernel_id))
+            with open(path, 'w'):
+                pass
+        return True
+
+    def release(self, kernel_id):
+        if self.limit <= 0:
+            return
+        path = os.path.join(self.slot_dir, '{}-{}'.format(os.getpid(), kernel_id))
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def count(self):
+        with self._locked():
+            return len(self._slots())
+
+
+def _is_running_as(pid, uid):
+    """Return whether the process `pid` is running as the user `uid`."""
+    try:
+        return os.stat('/proc/{}'.format(pid)).st_uid == uid
+    except OSError:
+        if os.path.isdir('/proc/self'):
+            return False
+    # without procfs, only a process of this user can be told apart
+    if uid != os.geteuid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+class KernelPoolMixin(LoggingConfigurable):
+    """Hand out pre-started kernels to new sessions.
+
+    Mixed into a multi kernel manager whose `kernel_manager_class` is
+    `AsyncLCWrapperKernelManager`. Up to `pool_size` warm kernels are kept
+    for each kernel name and working directory which has been requested,
+    and for `pool_kernel_names` in the current directory from startup.
+    A kernel is refilled in the background when one is handed out.
+
+    A warm kernel runs in the environment of the server, so it is handed
+    out only to a request with no other arguments than `cwd` and an `env`
+    which is the same, but for `pool_ignored_env`. Other requests start a
+    new kernel.
+    """
+
+    pool_size = Integer(0, config=True,
+                        help='The number of warm kernels kept for each kernel name and working directory.')
+
+    pool_kernel_names = List(Unicode(), config=True,
+                             help='The kernel names warmed at startup.')
+
+    pool_host_limit = Integer(0, config=True,
+                              help='The maximum number of warm kernels on this host, shared by all users. 0 for no limit.')
+
+    pool_ready_timeout = Float(60, config=True,
+                               help='Seconds to wait for a pre-started kernel to be ready.')
+
+    pool_ignored_env = List(Unicode(), config=True,
+                            help='The environment variables of a request which a pre-started kernel may lack, e.g. JPY_SESSION_NAME.')
+
+    pool_slot_dir = Unicode(config=True,
+                            help='The directory holding the slots of warm kernels on this host.')
+
+    @default('pool_slot_dir')
+    def _pool_slot_dir_default(self):
+        return os.path.join(tempfile.gettempdir(), 'lc_wrapper-pool')
+
+    def __init__(self, **kwargs):
+        super(KernelPoolMixin, self).__init__(**kwargs)
+        self._pool = {}
+        self._pool_filling = {}
+        self._host_slots = HostSlots(slot_dir=self.pool_slot_dir,
+                                     limit=self.pool_host_limit, parent=self)
+        if self.pool_size > 0 and self.pool_kernel_names:
+            IOLoop.current().add_callback(self._warm_up)
+
+    def _warm_up(self):
+        cwd = getattr(self, 'root_dir', None) or os.getcwd()
+        for kernel_name in self.pool_kernel_names:
+            self._fill_pool(kernel_name, cwd)
+
+    def _pool_key(self, kernel_name, cwd):
+        return (kernel_name or self.default_kernel_name,
+                os.path.abspath(cwd) if cwd else os.getcwd())
+
+    def _is_pool_request(self, kwargs):
+        if set(kwargs) - {'cwd', 'env'}:
+            return False
+        env = kwargs.get('env')
+        if env is None:
+            return True
+        ignored = set(self.pool_ignored_env)
+        return {k: v for k, v in env.items() if k not in ignored} == \
+            {k: v for k, v in os.environ.items() if k not in ignored}
+
+    def pre_start_kernel(self, kernel_name, kwargs):
+        if self.pool_size <= 0 or not self._is_pool_request(kwargs):
+            return super(KernelPoolMixin, self).pre_start_kernel(kernel_name, kwargs)
+        key = self._pool_key(kernel_name, kwargs.get('cwd'))
+        warm = self._pool.get(key)
+        km = warm.pop(0) if warm else None
+        self._fill_pool(*key)
+        if km is None:
+            return super(KernelPoolMixin, self).pre_start_kernel(kernel_name, kwargs)
+        self._host_slots.release(km.kernel_id)
+        km.started_in_pool = True
+        self.log.info('Use the pre-started kernel %s (%s)', km.kernel_id, key[0])
+        return km, key[0], km.kernel_id
+
+    def _fill_pool(self, kernel_name, cwd):
+        key = (kernel_name, cwd)
+        if self.pool_size <= 0 or key in self._pool_filling:
+            return
+        self._pool_filling[key] = asyncio.ensure_future(self._refill(key))
+
+    async def _refill(self, key):
+        kernel_name, cwd = key
+        warm = self._pool.setdefault(key, [])
+        try:
+            while len(warm) < self.pool_size:
+                kernel_id = self.new_kernel_id()
+                try:
+                    # the lock may be held by a pool of another user
+                    acquired = await asyncio.get_running_loop().run_in_executor(
+                        None, self._host_slots.acquire, kernel_id)
+                except OSError as e:
+                    self.log.warning('Not pre-starting %s: cannot count the warm kernels '
+                                     'in %s: %s', kernel_name, self.pool_slot_dir, e)
+                    break
+                if not acquired:
+                    self.log.info('Not pre-starting %s: %d warm kernels on this host',
+                                  kernel_name, self.pool_host_limit)
+                    break
+                km, _, _ = super(KernelPoolMixin, self).pre_start_kernel(
+                    kernel_name, {'kernel_id': kernel_id})
+                try:
+                    await km.start_kernel(kernel_id=kernel_id, cwd=cwd)
+                    await self._wait_for_ready(km)
+                except asyncio.CancelledError:
+                    if km.has_kernel:
+                        await km.shutdown_kernel(now=True)
+                    self._host_slots.release(kernel_id)
+                    raise
+                except Exception:
+                    self.log.exception('Failed to pre-start %s', kernel_name)
+                    if km.has_kernel:
+                        await km.shutdown_kernel(now=True)
+                    self._host_slots.release(kernel_id)
+                    break
+                warm.append(km)
+                self.log.info('Pre-started kernel %s (%s) in %s', kernel_id, kernel_name, cwd)
+        finally:
+            self._pool_filling.pop(key, None)
+
+    async def _wait_for_ready(self, km):
+        # the wrapper kernel answers once its wrapped kernel is ready
+        kc = km.client()
+        kc.start_channels(hb=False)
+        try:
+            await kc.wait_for_ready(timeout=self.pool_ready_timeout)
+        finally:
+            kc.stop_channels()
+
+    def warm_kernel_count(self):
+        return sum(len(warm) for warm in self._pool.values())
+
+    def executing_kernel_count(self):
+        """The number of kernels of this manager running an execute_request."""
+        executing = ExecutionStateWatcher.executing_kernel_ids
+        return sum(1 for kernel_id in self.list_kernel_ids() if kernel_id in executing)
+
+    async def shutdown_pool(self, now=False):
+        for filling in list(self._pool_filling.values()):
+            filling.cancel()
+        await asyncio.gather(*self._pool_filling.values(), return_exceptions=True)
+        self._pool_filling.clear()
+        kms = [km for warm in self._pool.values() for km in warm]
+        self._pool.clear()
+        await asyncio.gather(*[km.shutdown_kernel(now=now) for km in kms],
+                             return_exceptions=True)
+        for km in kms:
+            self._host_slots.release(km.kernel_id)
+
+    async def shutdown_all(self, now=False):
+        await self.shutdown_pool(now=now)
+        await super(KernelPoolMixin, self).shutdown_all(now=now)
+
+
+class AsyncLCWrapperMultiKernelManager(KernelPoolMixin, AsyncMultiKernelManager):
+    """Multi kernel manager with a pool of pre-started LC_wrapper kernels"""
+
+    @default('kernel_manager_class')
+    def _kernel_manager_class_default(self):
+        return 'lc_wrapper.AsyncLCWrapperKernelManager'
+
+
+try:
+    from jupyter_server.services.kernels.kernelmanager import AsyncMappingKernelManager
+except ImportError:
+    pass
+else:
+    class AsyncLCWrapperMappingKernelManager(KernelPoolMixin, AsyncMappingKernelManager):
+        """Jupyter Server kernel manager with a pool of pre-started LC_wrapper kernels"""
+
+        @default('kernel_manager_class')
+        def _kernel_manager_class_default(self):
+            return 'lc_wrapper.AsyncLCWrapperKernelManager'
@@ -0,0 +1,41 @@
+import time
+
+
+class OutputRateMeter(object):
+    """Measure the output rate of an execution.
+
+    Lines and bytes are counted in windows of `window` seconds. The rate is
+    exceeded as soon as a window holds more than `max_lines` lines or
+    `max_bytes` bytes per second; a limit of None is not checked.
+    """
+
+    def __init__(self, max_lines=None, max_bytes=None, window=1.0, clock=time.monotonic):
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.window = window
+        self.clock = clock
+        self.lines = 0
+        self.bytes = 0
+        self.total_lines = 0
+        self.total_bytes = 0
+        self._window_start = None
+
+    def add(self, lines, size):
+        """Count an output and return whether the rate is exceeded."""
+        now = self.clock()
+        if self._window_start is None or now - self._window_start >= self.window:
+            self._window_start = now
+            self.lines = 0
+            self.bytes = 0
+        self.lines += lines
+        self.bytes += size
+        self.total_lines += lines
+        self.total_bytes += size
+        return self.exceeded()
+
+    def exceeded(self):
+        if self.max_lines is not None and self.lines > self.max_lines * self.window:
+            return True
+        if self.max_bytes is not None and self.bytes > self.max_bytes * self.window:
+            return True
+        return False
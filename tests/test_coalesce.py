@@ -0,0 +1,64 @@
+from lc_wrapper.coalesce import StreamCoalescer
+
+from .helpers import DummyClock
+
+
+def stream(name, text):
+    return {'name': name, 'text': text}
+
+
+def create_coalescer(**kwargs):
+    sent = []
+    clock = DummyClock()
+
+    def send(parent_header, msg, content):
+        sent.append((parent_header['msg_id'], msg['header']['msg_id'], content))
+
+    return StreamCoalescer(send, clock=clock, **kwargs), sent, clock
+
+
+def add(coalescer, parent_msg_id, msg_id, content):
+    coalescer.add({'msg_id': parent_msg_id}, {'header': {'msg_id': msg_id}}, content)
+
+
+def test_merge_within_interval():
+    coalescer, sent, clock = create_coalescer(interval=0.1)
+    add(coalescer, 'p', 'm1', stream('stdout', 'a\n'))
+    clock.now = 0.05
+    add(coalescer, 'p', 'm2', stream('stdout', 'b\n'))
+    assert sent == []
+
+    coalescer.flush()
+    assert sent == [('p', 'm1', stream('stdout', 'a\nb\n'))]
+    assert coalescer.deadline is None
+    assert (coalescer.received, coalescer.sent) == (2, 1)
+
+
+def test_flush_when_interval_expired():
+    coalescer, sent, clock = create_coalescer(interval=0.1)
+    add(coalescer, 'p', 'm1', stream('stdout', 'a\n'))
+    coalescer.flush_expired()
+    assert sent == []
+
+    clock.now = 0.1
+    coalescer.flush_expired()
+    assert sent == [('p', 'm1', stream('stdout', 'a\n'))]
+
+
+def test_flush_when_max_bytes_held():
+    coalescer, sent, clock = create_coalescer(max_bytes=4)
+    add(coalescer, 'p', 'm1', stream('stdout', 'ab'))
+    add(coalescer, 'p', 'm2', stream('stdout', 'cd'))
+    add(coalescer, 'p', 'm3', stream('stdout', 'e'))
+    assert sent == [('p', 'm1', stream('stdout', 'abcd'))]
+
+
+def test_not_merge_other_name_or_parent():
+    coalescer, sent, clock = create_coalescer()
+    add(coalescer, 'p', 'm1', stream('stdout', 'a'))
+    add(coalescer, 'p', 'm2', stream('stderr', 'b'))
+    add(coalescer, 'q', 'm3', stream('stderr', 'c'))
+    coalescer.flush()
+    assert sent == [('p', 'm1', stream('stdout', 'a')),
+                    ('p', 'm2', stream('stderr', 'b')),
+                    ('q', 'm3', stream('stderr', 'c'))]
@@ -0,0 +1,78 @@
+import os
+
+from lc_wrapper.filecache import FileCache
+
+
+def test_load_once_while_unchanged(tmp_path):
+    path = str(tmp_path / 'config')
+    with open(path, 'w') as f:
+        f.write('a')
+    loads = []
+
+    def load(p):
+        loads.append(p)
+        with open(p) as f:
+            return f.read()
+
+    cache = FileCache()
+    assert cache.get(path, load) == 'a'
+    assert cache.get(path, load) == 'a'
+    assert loads == [path]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_reload_changed_file(tmp_path):
+    path = str(tmp_path / 'config')
+    with open(path, 'w') as f:
+        f.write('a')
+    cache = FileCache()
+    assert cache.get(path, lambda p: open(p).read()) == 'a'
+
+    with open(path, 'w') as f:
+        f.write('bb')
+    assert cache.get(path, lambda p: open(p).read()) == 'bb'
+
+    # same size, older mtime
+    with open(path, 'w') as f:
+        f.write('cc')
+    os.utime(path, ns=(0, 0))
+    assert cache.get(path, lambda p: open(p).read()) == 'cc'
+    assert cache.misses == 3
+
+
+def test_missing_file(tmp_path):
+    path = str(tmp_path / 'config')
+    cache = FileCache()
+    assert cache.get(path, lambda p: 'loaded', default={}) == {}
+
+    open(path, 'w').close()
+    assert cache.get(path, lambda p: 'loaded') == 'loaded'
+    os.remove(path)
+    assert cache.get(path, lambda p: 'loaded') is None
+
+
+def test_not_cache_errors(tmp_path):
+    path = str(tmp_path / 'config')
+    open(path, 'w').close()
+    cache = FileCache()
+
+    def fail(p):
+        raise ValueError(p)
+    try:
+        cache.get(path, fail)
+    except ValueError:
+        pass
+    assert cache.get(path, lambda p: 'loaded') == 'loaded'
+
+
+def test_use_given_stat(tmp_path, monkeypatch):
+    path = str(tmp_path / 'config')
+    open(path, 'w').close()
+    st = os.stat(path)
+    cache = FileCache()
+
+    def stat(p):
+        raise AssertionError('stat ' + p)
+    monkeypatch.setattr(os, 'stat', stat)
+    assert cache.get(path, lambda p: 'loaded', st=st) == 'loaded'
+    assert cache.get(path, lambda p: 'reloaded', st=st) == 'loaded'
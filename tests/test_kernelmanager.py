@@ -0,0 +1,115 @@
+import asyncio
+import os
+import tempfile
+import time
+
+from lc_wrapper.async_kernelmanager import AsyncLCWrapperKernelManager
+from lc_wrapper.kernelmanager import ExecutionStateWatcher, LCWrapperKernelManager
+
+from .helpers import wrapper_kernel_spec
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_wrapper_kernel(cwd, **kwargs):
+    km = LCWrapperKernelManager(kernel_name='lc_wrapper_test', **kwargs)
+    km._kernel_spec = wrapper_kernel_spec()
+    km.start_kernel(cwd=cwd, env=dict(os.environ, PYTHONPATH=ROOT))
+    kc = km.client()
+    kc.start_channels()
+    kc.wait_for_ready(timeout=60)
+    return km, kc
+
+
+def wait_for_execution(km, kc, code):
+    # `code` prints once it is ready to be interrupted
+    msg_id = kc.execute(code)
+    while True:
+        msg = kc.get_iopub_msg(timeout=60)
+        if msg['parent_header'].get('msg_id') == msg_id and \
+           msg['msg_type'] == 'stream':
+            break
+    watcher = km._state_watcher
+    while not watcher.executing and watcher.stream.socket.poll(5000):
+        watcher.stream.flush()
+    assert watcher.executing
+
+
+def test_shutdown_idle_kernel_without_waiting():
+    with tempfile.TemporaryDirectory() as cwd:
+        km, kc = start_wrapper_kernel(cwd)
+        kc.execute_interactive('pass', timeout=60)
+        kc.stop_channels()
+
+        start = time.monotonic()
+        km.shutdown_kernel(now=True)
+        assert time.monotonic() - start < 3.0
+        assert km._state_watcher is None
+
+
+def test_shutdown_waits_for_interrupted_execution():
+    with tempfile.TemporaryDirectory() as cwd:
+        km, kc = start_wrapper_kernel(cwd)
+        wait_for_execution(km, kc, 'import time; print(1); time.sleep(60)')
+        kc.stop_channels()
+
+        start = time.monotonic()
+        watcher = km._state_watcher
+        km.shutdown_kernel(now=True)
+        assert time.monotonic() - start < 5.0
+        assert not watcher.executing
+
+
+def test_shutdown_wait_is_bounded():
+    with tempfile.TemporaryDirectory() as cwd:
+        km, kc = start_wrapper_kernel(cwd, shutdown_wait_time=1.0)
+        wait_for_execution(km, kc, 'import signal, time\n'
+                                   'signal.signal(signal.SIGINT, signal.SIG_IGN)\n'
+                                   'print(1)\n'
+                                   'time.sleep(60)')
+        kc.stop_channels()
+
+        start = time.monotonic()
+        watcher = km._state_watcher
+        km.shutdown_kernel(now=True)
+        elapsed = time.monotonic() - start
+        assert 1.0 <= elapsed < 4.0
+        assert watcher.executing
+        assert km.kernel_id not in ExecutionStateWatcher.executing_kernel_ids
+
+
+def test_watch_only_status_messages():
+    async def run(cwd):
+        km = AsyncLCWrapperKernelManager(kernel_name='lc_wrapper_test')
+        km._kernel_spec = wrapper_kernel_spec()
+        await km.start_kernel(cwd=cwd, env=dict(os.environ, PYTHONPATH=ROOT))
+        kc = km.client()
+        kc.start_channels()
+        try:
+            await kc.wait_for_ready(timeout=60)
+            watcher = km._state_watcher
+            msg_id = kc.execute('import sys, time\n'
+                                'for i in range(200):\n'
+                                '    print(i); sys.stdout.flush()\n'
+                                'time.sleep(1)')
+            while True:
+                msg = await kc.get_iopub_msg(timeout=60)
+                if msg['parent_header'].get('msg_id') == msg_id and \
+                   msg['msg_type'] == 'execute_input':
+                    break
+            assert not await watcher.wait_for_idle(0.1)
+            assert watcher.executing
+            assert km.kernel_id in ExecutionStateWatcher.executing_kernel_ids
+
+            assert await watcher.wait_for_idle(30)
+            assert km.kernel_id not in ExecutionStateWatcher.executing_kernel_ids
+            assert watcher._topic.endswith(b'.status')
+            # busy and idle of kernel_info and execute, not the stream messages
+            assert watcher.status_msg_count < 10
+        finally:
+            kc.stop_channels()
+            await km.shutdown_kernel(now=True)
+        assert km._state_watcher is None
+
+    with tempfile.TemporaryDirectory() as cwd:
+        asyncio.run(run(cwd))
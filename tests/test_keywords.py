@@ -0,0 +1,181 @@
+import random
+import re
+
+from lc_wrapper.kernel import IPYTHON_DEFAULT_PATTERN
+from lc_wrapper.keywords import (
+    KeywordMatcher, literal_prefixes, required_literals, superlinear_reason
+)
+
+from .helpers import highlight_one_by_one
+
+
+def default_patterns():
+    return [re.compile(p) for p in IPYTHON_DEFAULT_PATTERN.splitlines()]
+
+
+def test_same_as_searching_one_by_one():
+    patterns = default_patterns()
+    matcher = KeywordMatcher(patterns)
+    assert matcher.searched_patterns == []
+
+    words = ['error', 'Error:', 'not found', 'Not Found', 'no space', 'low disk space',
+             'started', 'restarted', 'is not', 'link up', 'abc', '123', 'ok', ' ',
+             'disconnected', 'reconnect', 'Device not ready', 'nothing', '']
+    rand = random.Random(0)
+    for _ in range(2000):
+        text = ' '.join(rand.choice(words) for _ in range(rand.randint(0, 8)))
+        assert matcher.highlight(text) == highlight_one_by_one(patterns, text), text
+
+
+def test_longest_keyword_at_same_position():
+    patterns = [re.compile('start'), re.compile('start(ed)?'), re.compile('star')]
+    matcher = KeywordMatcher(patterns)
+    assert matcher.highlight('restarted') == u're\033[0;31mstarted\033[0m'
+
+
+def test_anchors_match_after_each_keyword():
+    # the rest of the line is searched as a new string
+    patterns = [re.compile('^ab'), re.compile(r'\bc')]
+    matcher = KeywordMatcher(patterns)
+    for text in ['abab', 'abc', 'ab c', 'xabc']:
+        assert matcher.highlight(text) == highlight_one_by_one(patterns, text)
+
+
+def test_leading_literals():
+    assert literal_prefixes(re.compile('ERROR|error')) == ['ERROR', 'error']
+    assert sorted(literal_prefixes(re.compile('(No|no) (.+ )?space'))) == ['No ', 'no ']
+    assert sorted(literal_prefixes(re.compile('(Device)? not'))) == [' not', 'Device n']
+    assert literal_prefixes(re.compile(r'\bstop')) == ['stop']
+    assert literal_prefixes(re.compile('[a-z]+ed')) is None
+    assert literal_prefixes(re.compile('(?i)error')) is None
+    assert literal_prefixes(re.compile('x*')) is None
+    assert sorted(literal_prefixes(re.compile('x*y'))) == ['x', 'y']
+
+
+def test_search_patterns_without_leading_literals():
+    patterns = [re.compile('[0-9]+ errors'), re.compile('(?i)warn'), re.compile(r'(a)\1')]
+    matcher = KeywordMatcher(patterns)
+    assert matcher.searched_patterns == patterns[:2]
+    for text in ['3 errors', 'WARN: 3 errors', 'aa 3 errors aa', 'xaa Warn', 'none']:
+        assert matcher.highlight(text) == highlight_one_by_one(patterns, text), text
+
+
+def test_required_literals():
+    assert required_literals(re.compile('[0-9]+ errors')) == [' errors']
+    assert required_literals(re.compile(r'\w+Error\b')) == ['Error']
+    assert required_literals(re.compile('[a-z]+ (fail|abort)ed')) == ['fail', 'abort']
+    assert required_literals(re.compile('[a-z]+ (f|abort)ed')) == ['ed']
+    assert required_literals(re.compile('.(ab)+')) == ['ab']
+    assert required_literals(re.compile('.(ab)*')) is None
+    assert required_literals(re.compile('[0-9]+(x|[a-z])')) is None
+    assert required_literals(re.compile('(?i).error')) is None
+    assert required_literals(re.compile('.[xy]')) == ['x', 'y']
+
+
+def test_prefilter_rejects_lines_without_required_literals():
+    patterns = default_patterns() + [re.compile('[0-9]+ (errors|failures)'),
+                                     re.compile(r'\w+Exception')]
+    matcher = KeywordMatcher(patterns)
+    assert matcher.unfiltered_patterns == []
+
+    words = ['3 errors', '0 failures', 'ValueException', 'Exception', 'error', 'abc',
+             '123', 'not found', 'errors', ' ', '']
+    rand = random.Random(0)
+    for _ in range(2000):
+        text = ' '.join(rand.choice(words) for _ in range(rand.randint(0, 6)))
+        assert matcher.highlight(text) == highlight_one_by_one(patterns, text), text
+    assert matcher.lines_checked == 2000
+    assert 0 < matcher.lines_rejected < 2000
+    assert matcher.lines_matched + matcher.lines_rejected <= 2000
+
+
+def test_no_prefilter_with_patterns_without_literal():
+    patterns = [re.compile('error'), re.compile('[0-9]{3}')]
+    matcher = KeywordMatcher(patterns)
+    assert matcher.unfiltered_patterns == patterns[1:]
+    assert matcher.highlight('code 404') == u'code \033[0;31m404\033[0m'
+    assert matcher.highlight('all good') is None
+    assert matcher.lines_rejected == 0
+
+
+def highlight_each_line(matcher, text):
+    lines = [matcher.highlight(line) for line in text.splitlines()]
+    return [line for line in lines if line is not None]
+
+
+def test_highlight_lines_same_as_each_line():
+    patterns = default_patterns() + [re.compile('[0-9]+ errors'), re.compile('b\nerror'),
+                                     re.compile('^not'), re.compile('(?<=x)error')]
+    words = ['error', 'not found', '3 errors', 'abc', 'x', 'b', '\n', '\r\n', '\r',
+             '\x0b', '\u2028', '\x85', ' ', '']
+    matcher = KeywordMatcher(patterns)
+    rand = random.Random(0)
+    lines = 0
+    for _ in range(1000):
+        text = ''.join(rand.choice(words) for _ in range(rand.randint(0, 30)))
+        assert matcher.highlight_lines(text, text.splitlines()) == \
+            highlight_each_line(matcher, text), repr(text)
+        lines += len(text.splitlines())
+    assert matcher.lines_checked == lines * 2
+
+
+def test_highlight_lines_counts_rejected_lines():
+    matcher = KeywordMatcher(default_patterns())
+    text = 'ok\nan error\n\nall good\nnot found\n'
+    assert matcher.highlight_lines(text, text.splitlines()) == [
+        u'an \033[0;31merror\033[0m', u'\033[0;31mnot found\033[0m']
+    assert (matcher.lines_checked, matcher.lines_rejected, matcher.lines_matched) == (5, 3, 2)
+
+
+def test_highlight_lines_without_prefilter():
+    patterns = [re.compile('error'), re.compile('[0-9]{3}')]
+    text = 'code 404\nok\nerror'
+    assert KeywordMatcher(patterns).highlight_lines(text, text.splitlines()) == \
+        highlight_each_line(KeywordMatcher(patterns), text)
+
+
+def test_empty_keyword_does_not_loop():
+    assert KeywordMatcher([re.compile('x*')]).highlight('ab') == \
+        u'\033[0;31m\033[0ma\033[0;31m\033[0mb\033[0;31m\033[0m'
+
+
+def test_no_match():
+    assert KeywordMatcher(default_patterns()).highlight('all good') is None
+    assert KeywordMatcher([]).highlight('error') is None
+
+
+def test_superlinear_patterns():
+    for p, reason in [(r'(a+)+b', 'nested repeats'),
+                      (r'(\w+\s?)*$', 'nested repeats'),
+                      (r'x(a|ab)+y', 'alternatives matching the same text in a repeat'),
+                      (r'(a|)+b', 'alternatives matching the same text in a repeat'),
+                      (r'(\w+) \1', 'backreference'),
+                      (r'.*error', 'leading unbounded repeat'),
+                      (r'[0-9a-zA-Z_]+@[0-9a-zA-Z.]+?com', 'leading unbounded repeat')]:
+        assert superlinear_reason(re.compile(p)) == reason, p
+    for p in [r'error', r'passwa(\-)*d', r'(?:ab|cd)+', r'\d+', r'(No|no) (.+ )?space']:
+        assert superlinear_reason(re.compile(p)) is None, p
+    for p in default_patterns():
+        assert superlinear_reason(p) is None, p.pattern
+
+
+def test_skip_lines_longer_than_the_limit():
+    matcher = KeywordMatcher([re.compile('error')], max_line_length=20)
+    assert matcher.highlight('an error') == 'an \033[0;31merror\033[0m'
+    assert matcher.highlight('an error' + ' ' * 20) is None
+    text = 'error\n' + 'error ' * 10 + '\nerror'
+    assert matcher.highlight_lines(text, text.splitlines()) == ['\033[0;31merror\033[0m'] * 2
+    assert matcher.lines_over_budget == 2
+    assert matcher.lines_matched == 3
+
+
+def test_skip_pattern_over_the_line_budget():
+    matcher = KeywordMatcher([re.compile('(a+)+b'), re.compile('error')], line_budget=0.1)
+    line = 'a' * 22 + ' error'
+    assert matcher.highlight(line) is None
+    assert matcher.lines_over_budget == 1
+    assert matcher.skipped_patterns == ['(a+)+b']
+    assert matcher.highlight(line) == 'a' * 22 + ' \033[0;31merror\033[0m'
+    assert matcher.highlight('aab') is None
+    assert matcher.lines_over_budget == 1
+    assert matcher.lines_matched == 1
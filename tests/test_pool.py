@@ -0,0 +1,170 @@
+import asyncio
+import fcntl
+import os
+import subprocess
+import sys
+
+import pytest
+
+from lc_wrapper.pool import AsyncLCWrapperMultiKernelManager, HostSlots
+
+
+def test_host_slots_limit(tmp_path):
+    slots = HostSlots(slot_dir=str(tmp_path / 'slots'), limit=2)
+    assert slots.acquire('a')
+    assert slots.acquire('b')
+    assert not slots.acquire('c')
+    assert slots.count() == 2
+
+    slots.release('a')
+    assert slots.acquire('c')
+
+
+def test_host_slots_ignore_dead_process(tmp_path):
+    slots = HostSlots(slot_dir=str(tmp_path), limit=1)
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    open(os.path.join(str(tmp_path), '{}-x'.format(dead.pid)), 'w').close()
+
+    assert slots.acquire('a')
+    assert not os.path.exists(os.path.join(str(tmp_path), '{}-x'.format(dead.pid)))
+
+
+def test_host_slots_ignore_files_of_other_users(tmp_path):
+    slots = HostSlots(slot_dir=str(tmp_path), limit=1)
+    # a file named after a running process of another user
+    if os.geteuid() == 0:
+        path = os.path.join(str(tmp_path), '{}-x'.format(os.getpid()))
+        open(path, 'w').close()
+        os.chown(path, 65534, 65534)
+    else:
+        path = os.path.join(str(tmp_path), '1-x')
+        open(path, 'w').close()
+
+    assert slots.acquire('a')
+    assert slots.count() == 1
+
+
+def test_host_slots_lock_timeout(tmp_path):
+    slots = HostSlots(slot_dir=str(tmp_path), limit=1, lock_timeout=0.1)
+    assert slots.count() == 0
+    fd = os.open(os.path.join(str(tmp_path), '.lock'), os.O_RDONLY)
+    try:
+        # held by the pool of another user
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        with pytest.raises(TimeoutError):
+            slots.acquire('a')
+    finally:
+        os.close(fd)
+    assert slots.acquire('a')
+
+
+def test_host_slots_lock_shared_by_users(tmp_path):
+    umask = os.umask(0o022)
+    try:
+        slots = HostSlots(slot_dir=str(tmp_path), limit=1)
+        assert slots.acquire('a')
+    finally:
+        os.umask(umask)
+    lock_path = os.path.join(str(tmp_path), '.lock')
+    assert os.stat(lock_path).st_mode & 0o777 == 0o666
+
+    # a lock file which cannot be written
+    os.chmod(lock_path, 0o444)
+    slots.release('a')
+    assert slots.acquire('b')
+
+
+def test_not_pre_start_without_host_slots(tmp_path, monkeypatch):
+    def acquire(self, kernel_id):
+        raise PermissionError(13, 'Permission denied')
+    monkeypatch.setattr(HostSlots, 'acquire', acquire)
+
+    async def run():
+        mkm = AsyncLCWrapperMultiKernelManager(
+            pool_size=1, pool_host_limit=2, pool_slot_dir=str(tmp_path),
+            default_kernel_name='python3')
+        mkm._fill_pool('python3', str(tmp_path))
+        await asyncio.gather(*mkm._pool_filling.values())
+        assert mkm.warm_kernel_count() == 0
+        assert mkm._pool_filling == {}
+
+    asyncio.run(run())
+
+
+def test_host_slots_without_limit(tmp_path):
+    slots = HostSlots(slot_dir=str(tmp_path / 'slots'), limit=0)
+    for i in range(10):
+        assert slots.acquire(str(i))
+    assert not os.path.exists(str(tmp_path / 'slots'))
+
+
+def test_hand_out_pre_started_kernel(tmp_path):
+    async def run():
+        mkm = AsyncLCWrapperMultiKernelManager(
+            pool_size=1, pool_host_limit=2, pool_slot_dir=str(tmp_path),
+            default_kernel_name='python3')
+        try:
+            mkm._fill_pool('python3', str(tmp_path))
+            await asyncio.gather(*mkm._pool_filling.values())
+            warm_km = mkm._pool[('python3', str(tmp_path))][0]
+            assert mkm.warm_kernel_count() == 1
+
+            kernel_id = await mkm.start_kernel(kernel_name='python3', cwd=str(tmp_path))
+            assert kernel_id == warm_km.kernel_id
+            assert mkm.get_kernel(kernel_id) is warm_km
+            assert await warm_km.is_alive()
+
+            # refilled in the background
+            await asyncio.gather(*mkm._pool_filling.values())
+            assert mkm.warm_kernel_count() == 1
+            assert len(os.listdir(str(tmp_path))) == 2  # the lock and one slot
+        finally:
+            await mkm.shutdown_all(now=True)
+        assert mkm.warm_kernel_count() == 0
+        assert os.listdir(str(tmp_path)) == ['.lock']
+
+    asyncio.run(run())
+
+
+def test_not_hand_out_pre_started_kernel_to_other_env(tmp_path):
+    async def run():
+        mkm = AsyncLCWrapperMultiKernelManager(
+            pool_size=1, pool_slot_dir=str(tmp_path / 'slots'),
+            pool_ignored_env=['JPY_SESSION_NAME'], default_kernel_name='python3')
+        key = ('python3', str(tmp_path))
+        warm_km, _, _ = mkm.pre_start_kernel('python3', {'kernel_id': 'warm'})
+        mkm._pool[key] = [warm_km]
+        mkm._pool_filling[key] = None  # not refilled
+
+        for kwargs in [{'cwd': str(tmp_path), 'env': dict(os.environ, FOO='1')},
+                       {'cwd': str(tmp_path), 'kernel_id': 'other'},
+                       {'cwd': str(tmp_path), 'extra_arguments': ['--debug']}]:
+            km, _, _ = mkm.pre_start_kernel('python3', kwargs)
+            assert km is not warm_km
+        assert mkm._pool[key] == [warm_km]
+
+        env = dict(os.environ, JPY_SESSION_NAME=str(tmp_path / 'a.ipynb'))
+        km, _, _ = mkm.pre_start_kernel('python3', {'cwd': str(tmp_path), 'env': env})
+        assert km is warm_km
+
+    asyncio.run(run())
+
+
+def test_start_cold_kernel_in_other_directory(tmp_path):
+    async def run():
+        mkm = AsyncLCWrapperMultiKernelManager(
+            pool_size=1, pool_slot_dir=str(tmp_path / 'slots'),
+            default_kernel_name='python3')
+        try:
+            kernel_id = await mkm.start_kernel(kernel_name='python3', cwd=str(tmp_path))
+            assert kernel_id in mkm.list_kernel_ids()
+
+            await asyncio.gather(*mkm._pool_filling.values())
+            warm_km = mkm._pool[('python3', str(tmp_path))][0]
+            assert warm_km.kernel_id != kernel_id
+        finally:
+            await mkm.shutdown_all(now=True)
+        assert mkm.warm_kernel_count() == 0
+
+    asyncio.run(run())
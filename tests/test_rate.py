@@ -0,0 +1,28 @@
+from lc_wrapper.rate import OutputRateMeter
+
+from .helpers import DummyClock
+
+
+def test_exceed_lines_per_second():
+    clock = DummyClock()
+    meter = OutputRateMeter(max_lines=10, clock=clock)
+    assert not meter.add(10, 100)
+    clock.now = 0.5
+    assert meter.add(1, 10)
+    assert (meter.lines, meter.bytes) == (11, 110)
+
+
+def test_exceed_bytes_per_second():
+    clock = DummyClock()
+    meter = OutputRateMeter(max_bytes=100, clock=clock)
+    assert not meter.add(100, 100)
+    assert meter.add(1, 1)
+
+
+def test_count_in_new_window():
+    clock = DummyClock()
+    meter = OutputRateMeter(max_lines=10, clock=clock)
+    assert not meter.add(10, 100)
+    clock.now = 1.0
+    assert not meter.add(10, 100)
+    assert (meter.lines, meter.total_lines) == (10, 20)
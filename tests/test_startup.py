@@ -0,0 +1,81 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from jupyter_client.manager import KernelManager
+
+from .helpers import wrapper_kernel_spec
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def imported_modules(statement):
+    """Run `statement` with `python -X importtime` and return the modules it imports."""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                          env=env, stderr=subprocess.PIPE, universal_newlines=True,
+                          check=True)
+    modules = set()
+    for line in proc.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            modules.add(line.rsplit('|', 1)[1].strip())
+    return modules
+
+
+def time_to_first_replies(spec):
+    """Return the seconds from the launch to the kernel_info_reply and to
+    the execute_reply of requests sent right after it."""
+    km = KernelManager()
+    km.kernel_name = 'lc_wrapper_startup'
+    km._kernel_spec = spec
+    with tempfile.TemporaryDirectory() as cwd:
+        start = time.perf_counter()
+        km.start_kernel(cwd=cwd, env=dict(os.environ, PYTHONPATH=ROOT))
+        kc = km.client()
+        kc.start_channels()
+        try:
+            msg_ids = {kc.kernel_info(): 'kernel_info_reply',
+                       kc.execute('pass'): 'execute_reply'}
+            elapsed = {}
+            while len(elapsed) < len(msg_ids):
+                reply = kc.get_shell_msg(timeout=60)
+                elapsed[reply['msg_type']] = time.perf_counter() - start
+                assert reply['msg_type'] == msg_ids[reply['parent_header']['msg_id']]
+                assert reply['content']['status'] == 'ok'
+            return elapsed['kernel_info_reply'], elapsed['execute_reply']
+        finally:
+            kc.stop_channels()
+            km.shutdown_kernel(now=True)
+
+
+def test_server_side_import_does_not_load_kernel():
+    modules = imported_modules('import lc_wrapper')
+    assert 'ipykernel' not in modules
+    assert 'IPython' not in modules
+    assert 'lc_wrapper.kernel' not in modules
+
+
+def test_kernel_import_does_not_load_optional_modules():
+    modules = imported_modules('import lc_wrapper.ipython.kernel')
+    assert 'lc_wrapper.kernel' in modules
+    assert 'fluent.sender' not in modules
+    assert 'jupyter_core.application' not in modules
+    assert 'lc_wrapper.pool' not in modules
+    assert 'lc_wrapper.async_kernelmanager' not in modules
+    assert 'lc_wrapper.kernelmanager' not in modules
+    assert 'jupyter_client.ioloop' not in modules
+    assert 'lc_wrapper.offload' not in modules
+    assert 'multiprocessing' not in modules
+
+
+def test_first_kernel_info_reply_before_wrapped_kernel_is_ready():
+    # the wrapper starts the wrapped kernel in the background, so it
+    # replies to kernel_info well before the execute_request, which waits
+    # for the wrapped kernel; retried on a busy host
+    for _ in range(3):
+        kernel_info, execute = time_to_first_replies(wrapper_kernel_spec())
+        if kernel_info < execute * 0.75:
+            break
+    assert kernel_info < execute * 0.75, (kernel_info, execute)